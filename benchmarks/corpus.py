@@ -0,0 +1,110 @@
+"""
+Synthetic gist corpora for the benchmarks.
+
+Databases use the same list_table/code_table schema a real sync writes and are
+generated deterministically from a seed, so runs on different commits search the
+same data.
+"""
+import os
+import random
+
+from gistfinder.loader import Loader
+from gistfinder.sync import Updater
+
+WORDS = (
+    'pandas numpy frame series merge join groupby pivot plot figure axis docker kube '
+    'deploy git rebase vim bash curl json yaml sql query index sort heap async await '
+    'thread pool regex parse token lexer socket server client request response cache '
+    'redis postgres sqlite django flask route model schema migrate test mock fixture '
+    'matrix vector tensor train batch epoch loss metric csv excel parquet arrow spark'
+).split()
+
+EXTENSIONS = ['py', 'py', 'py', 'sh', 'sql', 'js', 'md', 'yaml']
+LANGUAGES = {'py': 'Python', 'sh': 'Shell', 'sql': 'SQL', 'js': 'JavaScript', 'md': 'Markdown', 'yaml': 'YAML'}
+
+
+def make_code(rng, num_lines):
+    lines = []
+    for _ in range(num_lines):
+        indent = '    ' * rng.randint(0, 2)
+        words = rng.sample(WORDS, rng.randint(2, 6))
+        lines.append('{}{} = {}({})'.format(indent, words[0], words[1], ', '.join(words[2:])))
+    return '\n'.join(lines)
+
+
+def make_file_records(num_files, seed=0):
+    rng = random.Random(seed)
+    gist_ind = 0
+    files_left = 0
+    for ind in range(num_files):
+        if files_left == 0:
+            gist_ind += 1
+            files_left = rng.choice([1, 1, 1, 2, 3])
+            description = ' '.join(rng.sample(WORDS, rng.randint(2, 8)))
+            updated_at = '2020-{:02d}-{:02d}T00:00:00Z'.format(rng.randint(1, 12), rng.randint(1, 28))
+        files_left -= 1
+
+        ext = rng.choice(EXTENSIONS)
+        file_name = '{}_{}_{}.{}'.format(rng.choice(WORDS), rng.choice(WORDS), ind, ext)
+        # Mostly small snippets with the occasional very large file
+        num_lines = rng.randint(1000, 5000) if rng.random() < .005 else int(rng.expovariate(1 / 40)) + 1
+        code = make_code(rng, num_lines)
+        gist_id = f'{gist_ind:032x}'
+        file_url = f'https://gist.githubusercontent.com/bench/{gist_id}/raw/{file_name}'
+
+        list_rec = dict(
+            url=f'https://api.github.com/gists/{gist_id}',
+            description=description,
+            created_at=updated_at,
+            updated_at=updated_at,
+            file=file_name,
+            language=LANGUAGES[ext],
+            file_url=file_url,
+            size=len(code),
+            gist_id=gist_id,
+        )
+        code_rec = dict(file_url=file_url, code=code, updated_at=updated_at)
+        yield list_rec, code_rec
+
+
+def classes_for(db_file, settings=None):
+    """
+    Returns Loader and Updater subclasses pointed at db_file that never read the
+    user's github config.
+    """
+    attrs = dict(
+        db_file=db_file,
+        db_url=f'sqlite:///{db_file}',
+        settings=dict(settings or {}),
+        _check_okay=lambda self: None,
+    )
+    return type('BenchLoader', (Loader,), attrs), type('BenchUpdater', (Updater,), attrs)
+
+
+def build_db(db_file, num_files, seed=0, indexes=True):
+    """
+    Creates db_file with num_files synthetic files unless it already exists, and
+    precomputes the search table the way a sync does so that loads are timed on
+    the path users hit.
+    """
+    from gistfinder.utils import chunked
+    _, updater_class = classes_for(db_file)
+    updater = updater_class()
+    if not os.path.isfile(db_file):
+        for batch in chunked(make_file_records(num_files, seed), 1000):
+            with updater.db as tx:
+                tx[Updater.LIST_TABLE].insert_many([b[0] for b in batch])
+                tx[Updater.CODE_TABLE].insert_many([b[1] for b in batch])
+        updater.list_table.create_index(['file_url'])
+        updater.code_table.create_index(['file_url'])
+
+        if indexes:
+            updater.update_fts_table()
+            updater.update_trigram_table()
+
+    # The same steps as the end of Updater.sync_tables
+    version = updater.corpus_version()
+    if updater.get_meta('search_version') != version:
+        updater.set_meta('corpus_version', version)
+        updater.update_search_table(version)
+    return db_file
@@ -0,0 +1,93 @@
+"""
+Throughput and agreement benchmark for the search scorers.
+
+Scores synthetic gists for a set of queries with every scorer, reports choices
+scored per second, and compares each scorer's top matches with fuzzywuzzy's.
+
+    python benchmarks/scorers.py [--files 2000] [--queries 10] [--field text] [--output scorers.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import WORDS, make_file_records  # noqa
+from gistfinder.scorers import SCORERS, get_scorer  # noqa
+
+REFERENCE = 'fuzzywuzzy'
+
+
+def make_choices(num_files, field):
+    choices = {}
+    for ind, (list_rec, code_rec) in enumerate(make_file_records(num_files)):
+        values = {
+            'file_name': list_rec['file'],
+            'description': list_rec['description'],
+            'code': code_rec['code'],
+        }
+        values['text'] = '\n'.join([values['file_name'], values['description'], values['code']])
+        choices[ind] = values[field]
+    return choices
+
+
+def top(scores, k):
+    return [key for key, _ in sorted(scores.items(), key=lambda t: (-t[1], t[0]))[:k]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=10)
+    parser.add_argument('--field', default='text', choices=['text', 'file_name', 'description', 'code'])
+    parser.add_argument('--top', type=int, default=10, help='Size of the top-k compared with fuzzywuzzy')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    choices = make_choices(args.files, args.field)
+    rng = random.Random(0)
+    queries = [' '.join(rng.sample(WORDS, rng.randint(1, 3))) for _ in range(args.queries)]
+
+    results = {}
+    reference = {}
+    for name in SCORERS:
+        scorer = get_scorer(name)
+        try:
+            start = time.perf_counter()
+            scores = [scorer.score(query, choices) for query in queries]
+            elapsed = time.perf_counter() - start
+        except ImportError as e:
+            print(f'{name}: skipped ({e})', file=sys.stderr)
+            continue
+
+        if name == REFERENCE:
+            reference = dict(zip(queries, scores))
+
+        overlaps = [
+            len(set(top(s, args.top)) & set(top(reference[q], args.top))) / args.top
+            for q, s in zip(queries, scores)
+        ] if reference else []
+        results[name] = dict(
+            seconds=elapsed,
+            choices_per_second=len(choices) * len(queries) / elapsed,
+            mean_matches=sum(len(s) for s in scores) / len(scores),
+            top_overlap_with_reference=sum(overlaps) / len(overlaps) if overlaps else None,
+        )
+        print(
+            f'{name:>12}: {results[name]["choices_per_second"]:12,.0f} choices/s, '
+            f'{results[name]["mean_matches"]:8.0f} matches/query, '
+            f'top-{args.top} overlap with {REFERENCE}: {results[name]["top_overlap_with_reference"]:.2f}',
+            file=sys.stderr
+        )
+
+    if args.output:
+        with open(args.output, 'w') as buff:
+            json.dump(dict(files=args.files, field=args.field, queries=queries, results=results), buff, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Search benchmark over synthetic gist corpora.
+
+For each corpus size a fresh interpreter builds (or reuses) a synthetic database,
+then times the cold load of Loader.records, the latency of Loader.get for every
+search field, and records the peak RSS.  Results are written as json so runs on
+different commits can be compared.
+
+    python benchmarks/search.py --sizes 1000 10000 100000 --output search.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import WORDS, build_db, classes_for  # noqa
+
+FIELDS = ['glob_expr', 'text_expr', 'desc_expr', 'file_expr', 'code_expr']
+
+
+def make_queries(num_queries, seed=0):
+    rng = random.Random(seed)
+    queries = {field: [] for field in FIELDS}
+    for _ in range(num_queries):
+        word = rng.choice(WORDS)
+        queries['glob_expr'].append(f'*{word}*.py')
+        queries['text_expr'].append(' '.join(rng.sample(WORDS, 2)))
+        queries['desc_expr'].append(word)
+        queries['file_expr'].append(f'{word}_{rng.choice(WORDS)}')
+        queries['code_expr'].append(f'{word}({rng.choice(WORDS)}')
+    return queries
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / 2 ** 20 if platform.system() == 'Darwin' else rss / 2 ** 10
+
+
+def run_size(db_file, num_files, num_queries, settings):
+    loader_class, _ = classes_for(db_file, settings)
+    loader = loader_class()
+
+    start = time.perf_counter()
+    num_records = len(loader.records)
+    cold_load = time.perf_counter() - start
+
+    latencies = {}
+    for field, exprs in make_queries(num_queries).items():
+        times = []
+        for expr in exprs:
+            # Time a cold search, not one answered or narrowed from an earlier query
+            loader.query_cache.clear()
+            loader.refine_stacks.clear()
+            start = time.perf_counter()
+            loader.get(**{field: expr})
+            times.append(time.perf_counter() - start)
+        latencies[field] = dict(
+            mean_ms=1000 * statistics.mean(times),
+            median_ms=1000 * statistics.median(times),
+            max_ms=1000 * max(times),
+        )
+
+    return dict(
+        num_files=num_files,
+        num_records=num_records,
+        settings=settings,
+        cold_load_s=cold_load,
+        query_latency=latencies,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, universal_newlines=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=5, help='Queries per search field')
+    parser.add_argument('--db-dir', default=os.path.join(BENCH_DIR, 'corpora'), help='Where corpora are cached')
+    parser.add_argument('--no-indexes', action='store_true', help='Build corpora without trigram/fts indexes')
+    parser.add_argument('--setting', action='append', default=[], metavar='KEY=JSON',
+                        help='Loader setting, e.g. SEARCH_BACKEND=\'"fts"\'')
+    parser.add_argument('--output', default='search_benchmark.json')
+    parser.add_argument('--worker', nargs=2, metavar=('DB_FILE', 'NUM_FILES'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    settings = {}
+    for setting in args.setting:
+        key, value = setting.split('=', 1)
+        settings[key] = json.loads(value)
+
+    if args.worker:
+        db_file, num_files = args.worker[0], int(args.worker[1])
+        json.dump(run_size(db_file, num_files, args.queries, settings), sys.stdout)
+        return
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    results = []
+    for num_files in args.sizes:
+        suffix = '' if not args.no_indexes else '_noindex'
+        db_file = os.path.join(args.db_dir, f'corpus_{num_files}{suffix}.sqlite')
+        start = time.perf_counter()
+        build_db(db_file, num_files, indexes=not args.no_indexes)
+        print(f'{num_files} files: corpus ready in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+        # A fresh interpreter per size keeps peak RSS honest
+        cmd = [sys.executable, __file__, '--worker', db_file, str(num_files), '--queries', str(args.queries)]
+        cmd.extend(f'--setting={s}' for s in args.setting)
+        result = json.loads(subprocess.check_output(cmd, universal_newlines=True))
+        results.append(result)
+
+        summary = ', '.join(f'{f}={v["median_ms"]:.1f}ms' for f, v in result['query_latency'].items())
+        print(
+            f'{num_files} files: load {result["cold_load_s"]:.2f}s, rss {result["peak_rss_mb"]:.0f}MB, {summary}',
+            file=sys.stderr
+        )
+
+    with open(args.output, 'w') as buff:
+        json.dump(dict(commit=git_commit(), python=platform.python_version(), results=results), buff, indent=2)
+    print(f'Wrote {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
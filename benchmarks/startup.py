@@ -0,0 +1,82 @@
+"""
+Cold-start benchmark for the gf entry point.
+
+Runs each command in a fresh interpreter several times, reports the best wall-clock
+time and the slowest imports (from python -X importtime), and exits non-zero if any
+command is over its budget.
+
+    python benchmarks/startup.py [--budget-ms 250] [--repeat 5]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+COMMANDS = {
+    'import': 'import gistfinder.console',
+    'help': 'from gistfinder.console import cli; cli(["--help"])',
+}
+
+# Nothing in this list should be imported just to start the cli
+HEAVY_MODULES = ['dataset', 'sqlalchemy', 'fuzzywuzzy', 'prompt_toolkit', 'pygments', 'requests', 'tqdm']
+
+IMPORT_TIME_REX = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def run(code, *flags):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, *flags, '-c', code],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+    return time.perf_counter() - start, proc.stderr
+
+
+def slowest_imports(code, count=10):
+    _, stderr = run(code, '-X', 'importtime')
+    rows = []
+    for line in stderr.splitlines():
+        m = IMPORT_TIME_REX.match(line)
+        if m:
+            rows.append((int(m.group(2)), m.group(4)))
+    return sorted(rows, reverse=True)[:count]
+
+
+def heavy_imports(code):
+    _, stderr = run(f'{code}\nimport sys\nprint(" ".join(sys.modules), file=sys.stderr)')
+    loaded = set(stderr.split())
+    return [m for m in HEAVY_MODULES if m in loaded]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=250.)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = min(run('pass')[0] for _ in range(args.repeat))
+    print(f'bare interpreter: {baseline * 1000:.0f} ms')
+
+    failed = False
+    for name, code in COMMANDS.items():
+        elapsed = min(run(code)[0] for _ in range(args.repeat))
+        heavy = heavy_imports(code)
+        over = elapsed * 1000 > args.budget_ms
+        failed = failed or over or bool(heavy)
+
+        status = 'FAIL' if over or heavy else 'ok'
+        print(f'\n{name}: {elapsed * 1000:.0f} ms (budget {args.budget_ms:.0f} ms) {status}')
+        if heavy:
+            print(f'  heavy modules imported: {", ".join(heavy)}')
+        for micros, module in slowest_imports(code):
+            print(f'  {micros / 1000:8.1f} ms  {module}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,61 @@
+import contextlib
 import os
 import sys
-import dataset
 import json
+import time
 from .utils import cached_property
 
 CONFIG_DIR = os.path.realpath(os.path.expanduser('~/.config/gistfinder'))
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def try_lock(buff):
+    """
+    Tries to take an exclusive lock on an open file without waiting.  The lock goes
+    when the file is closed.  Where the platform has no file locks at all, there is
+    nothing to wait for.
+    """
+    try:
+        if fcntl:
+            fcntl.flock(buff, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt:
+            msvcrt.locking(buff.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
 
 class Config:
     config_dir = CONFIG_DIR
     db_file = os.path.join(config_dir, 'database.sqlite')
     auth_file = os.path.join(config_dir, 'github_auth.json')
+    socket_file = os.path.join(config_dir, 'gistfinder.sock')
 
     db_url = 'sqlite:///{db_file}'.format(db_file=db_file)
 
     BASE_URL = 'https://api.github.com/gists'
     LIST_TABLE = 'list_table'
     CODE_TABLE = 'code_table'
+    TRIGRAM_TABLE = 'trigram_table'
+    TRIGRAM_FILE_TABLE = 'trigram_file_table'
+    FTS_TABLE = 'fts_table'
+    META_TABLE = 'meta_table'
+    PAGE_TABLE = 'page_table'
+    SEARCH_TABLE = 'search_table'
+    QUERY_TABLE = 'query_table'
+
+    # Bump when the search table's columns change so that syncs rebuild older tables
+    SEARCH_SCHEMA = '2'
+    # Likewise for the trigram index
+    TRIGRAM_SCHEMA = '2'
 
     def _check_okay(self):
         has_user = False
@@ -58,10 +97,42 @@ class Config:
         url = f'https://api.github.com/users/{user}/gists'
         return url
 
+    @property
+    def lock_file(self):
+        return self.db_file + '.lock'
+
+    @contextlib.contextmanager
+    def sync_lock(self, wait=True):
+        """
+        Holds an exclusive lock on lock_file so that only one process writes to the
+        database at a time: a sync, or a reader saving its rankings.  Yields False
+        instead of waiting if wait is False and the lock is held elsewhere.
+        """
+        os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
+        with open(self.lock_file, 'w') as buff:
+            if not try_lock(buff):
+                if not wait:
+                    yield False
+                    return
+                print('Waiting for another sync to finish', file=sys.stderr)
+                while not try_lock(buff):
+                    time.sleep(1)
+            yield True
+
+    def db_inode(self):
+        try:
+            return os.stat(self.db_file).st_ino
+        except FileNotFoundError:
+            return None
+
     @cached_property
     def db(self):
+        import dataset
         self._check_okay()
-        return dataset.connect(url=self.db_url)
+        # Writers check this to tell whether a sync has since swapped the file out
+        self.opened_db_inode = self.db_inode()
+        # Syncs replace the database file, so keep sqlite from leaving -wal files beside it
+        return dataset.connect(url=self.db_url, sqlite_wal_mode=False)
 
     @property
     def list_table(self):
@@ -71,6 +142,38 @@ class Config:
     def code_table(self):
         return self.db[self.CODE_TABLE]
 
+    @property
+    def page_table(self):
+        return self.db[self.PAGE_TABLE]
+
+    @property
+    def search_table(self):
+        return self.db[self.SEARCH_TABLE]
+
+    @property
+    def query_table(self):
+        return self.db[self.QUERY_TABLE]
+
+    @property
+    def meta_table(self):
+        return self.db[self.META_TABLE]
+
+    def get_meta(self, key, default=None):
+        if self.META_TABLE not in self.db.tables:
+            return default
+        row = self.meta_table.find_one(key=key)
+        return row['value'] if row else default
+
+    def set_meta(self, key, value):
+        self.meta_table.upsert(dict(key=key, value=value), ['key'])
+
+    @cached_property
+    def settings(self):
+        if os.path.isfile(self.auth_file):
+            with open(self.auth_file) as buff:
+                return json.load(buff)
+        return {}
+
     @cached_property
     def github_token(self):
         self._check_okay()
@@ -99,3 +202,21 @@ class Config:
 
     def set_github_user(self, user):
         self.update(GIST_USER=user)
+
+    def set_search_backend(self, backend):
+        self.update(SEARCH_BACKEND=backend)
+
+    def set_scorer(self, scorer):
+        self.update(SCORER=scorer)
+
+    def set_weighted_ranking(self, weighted):
+        self.update(WEIGHTED_RANKING=weighted)
+
+    def set_lazy_code(self, lazy):
+        self.update(LAZY_CODE=lazy)
+
+    def set_chunked_code(self, chunked):
+        self.update(CHUNKED_CODE=chunked)
+
+    def set_sync_interval(self, seconds):
+        self.update(SYNC_INTERVAL=seconds)
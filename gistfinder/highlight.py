@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+from prompt_toolkit.lexers import Lexer, PygmentsLexer
+from pygments.lexers import TextLexer, find_lexer_class_by_name, find_lexer_class_for_filename
+from pygments.util import ClassNotFound
+
+
+def lexer_class(language, file_name):
+    """
+    Returns the pygments lexer class for github's language name of a file, falling
+    back to guessing from the file name and then to plain text.
+    """
+    if language:
+        name = language.lower()
+        for alias in [name, name.replace(' ', '-'), name.replace(' ', '')]:
+            try:
+                return find_lexer_class_by_name(alias)
+            except ClassNotFound:
+                pass
+    return find_lexer_class_for_filename(file_name or '') or TextLexer
+
+
+class CodeLexer(Lexer):
+    """
+    Highlights the code pane with the lexer for the language of the file shown.
+    Lines are only lexed once they scroll into view (resyncing near them rather
+    than lexing from the top), and the lexed lines of recently viewed files are
+    kept, so going back to a file costs nothing.  Files over MAX_CHARS are shown
+    as plain text.
+    """
+    MAX_CHARS = 200_000
+    CACHE_SIZE = 32
+
+    def __init__(self):
+        self.file_url = None
+        self.language = None
+        self.file_name = None
+        self._lexers = {}
+        self._lines = OrderedDict()
+
+    def set_file(self, row):
+        """
+        Points the lexer at the record whose code is about to be shown.
+        """
+        self.file_url = row['file_url'] if row else None
+        self.language = row['language'] if row else None
+        self.file_name = row['file_name'] if row else None
+
+    def pygments_lexer(self):
+        klass = lexer_class(self.language, self.file_name)
+        if klass not in self._lexers:
+            self._lexers[klass] = PygmentsLexer(klass, sync_from_start=False)
+        return self._lexers[klass]
+
+    def lex_document(self, document):
+        key = self.file_url
+        cached = self._lines.get(key)
+        if cached and cached[0] == document.text:
+            self._lines.move_to_end(key)
+            return cached[1]
+
+        if len(document.text) > self.MAX_CHARS:
+            lines = document.lines
+
+            def get_line(lineno):
+                return [('', lines[lineno])] if lineno < len(lines) else []
+        else:
+            get_line = self.pygments_lexer().lex_document(document)
+
+        self._lines[key] = (document.text, get_line)
+        if len(self._lines) > self.CACHE_SIZE:
+            self._lines.popitem(last=False)
+        return get_line
+
+    def invalidation_hash(self):
+        return (self.file_url, self.language)
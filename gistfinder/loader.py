@@ -1,11 +1,113 @@
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import threading
 from collections import OrderedDict
+from collections.abc import Mapping
 from fnmatch import fnmatch
-from fuzzywuzzy import process
 from .config import Config
-from .utils import cached_property
+from .records import Column, RecordStore, RowSet
+from .scorers import SCORERS, get_scorer
+from .utils import cached_property, chunked, in_params, line_windows, search_text, trigrams
+
+
+class Ranking(Mapping):
+    """
+    A read-only mapping of row id to record that iterates in descending score order.
+    Only the best head_size records are ordered up front (heap selection); the rest
+    are sorted the first time iteration goes past them.
+    """
+    def __init__(self, records, scored, head_size, lines=None):
+        # scored is a list of (score, row id) pairs in the records' original order.
+        # Ties keep that order, like fuzzywuzzy's process.extract does.
+        self.records = records
+        self.scores = {row_id: score for score, row_id in scored}
+
+        # row id -> (first_line, last_line) of the code window that matched, when known
+        self.lines = lines or {}
+        self._keys = [row_id for _, _, row_id in heapq.nlargest(
+            head_size, ((score, -ind, row_id) for ind, (score, row_id) in enumerate(scored))
+        )]
+        self._scored = scored if len(self._keys) < len(scored) else None
+        self._lock = threading.Lock()
+
+    def _sort_tail(self):
+        with self._lock:
+            if self._scored is None:
+                return
+            head = set(self._keys)
+            tail = [(score, -ind, row_id) for ind, (score, row_id) in enumerate(self._scored) if row_id not in head]
+            tail.sort(reverse=True)
+            self._keys.extend(row_id for _, _, row_id in tail)
+            self._scored = None
+
+    def __iter__(self):
+        yield from self._keys[:]
+        if self._scored is not None:
+            num_head = len(self._keys)
+            self._sort_tail()
+            yield from self._keys[num_head:]
+
+    def __getitem__(self, row_id):
+        if row_id not in self.scores:
+            raise KeyError(row_id)
+        return self.records[row_id]
+
+    def __contains__(self, row_id):
+        return row_id in self.scores
+
+    def __len__(self):
+        return len(self.scores)
 
 
 class Loader(Config):
+    QUERY_CACHE_SIZE = 64
+
+    # This many of the most recent rankings are saved for the next session
+    QUERY_PERSIST_SIZE = 16
+
+    # Rankings fully order only this many of the best matches until more are needed
+    TOP_K = 100
+
+    # In lazy mode code bodies stay on disk and the most recently viewed are kept here
+    CODE_CACHE_SIZE = 128
+
+    # When a query grows, only records that scored at least this on the shorter query are re-scored
+    REFINE_MIN_SCORE = 50
+    REFINE_STACK_SIZE = 32
+    # Stacks are kept for this many (field, filters) contexts, least recently used dropped first
+    REFINE_CONTEXTS = 8
+
+    # Fraction of the query's trigrams a file must contain to be scored at all
+    TRIGRAM_MIN_OVERLAP = .5
+
+    # Either rank in python with fuzzywuzzy or let sqlite rank with FTS5/bm25
+    SEARCH_BACKENDS = ('fuzzy', 'fts')
+
+    # How the fuzzy backend scores records (see scorers.py)
+    SCORER_NAMES = tuple(SCORERS)
+
+    # Corpora at least this big are scored on a pool of SCORING_WORKERS processes
+    PARALLEL_MIN_RECORDS = 20_000
+
+    # In chunked mode code is scored in windows of this many lines, overlapping by CHUNK_OVERLAP
+    CHUNK_LINES = 40
+    CHUNK_OVERLAP = 10
+
+    # Relative weight of each field's score when ranking in a single weighted pass
+    FIELD_WEIGHTS = {'file_name': 3, 'description': 2, 'code': 1}
+
+    # Fields result_rows can report for each result
+    RESULT_FIELDS = ('gid', 'file_name', 'description', 'file_url', 'language', 'score', 'lines', 'code')
+
+    # bm25 column weights for (file_url, file_name, description, code)
+    FTS_WEIGHTS = (0, 10, 5, 1)
+    FTS_TOKEN_REX = re.compile(r'"([^"]+)"|(\S+)')
+
     @cached_property
     def has_tables(self):
         expected_tables = {Config.LIST_TABLE, Config.CODE_TABLE}
@@ -13,73 +115,591 @@ class Loader(Config):
         return existing_tables.intersection(expected_tables) == expected_tables
 
     @cached_property
-    def records(self):
+    def has_trigrams(self):
+        return Config.TRIGRAM_TABLE in self.db.tables and self.get_meta('trigram_schema') == Config.TRIGRAM_SCHEMA
+
+    @cached_property
+    def has_fts(self):
+        return Config.FTS_TABLE in self.db.tables
+
+    @cached_property
+    def corpus_version(self):
+        return self.get_meta('corpus_version')
+
+    @cached_property
+    def has_search_table(self):
+        # The precomputed search text is only used if it was built for the current corpus
+        if self.corpus_version is None or Config.SEARCH_TABLE not in self.db.tables:
+            return False
+        if self.get_meta('search_schema') != Config.SEARCH_SCHEMA:
+            return False
+        return self.get_meta('search_version') == self.corpus_version
+
+    @cached_property
+    def search_backend(self):
+        backend = self.settings.get('SEARCH_BACKEND', 'fuzzy')
+        if backend == 'fts' and not self.has_fts:
+            backend = 'fuzzy'
+        return backend
+
+    @cached_property
+    def scorer(self):
+        return get_scorer(self.settings.get('SCORER', 'fuzzywuzzy'), self.settings.get('SCORE_CUTOFF', 0))
+
+    @cached_property
+    def scoring_workers(self):
+        return int(self.settings.get('SCORING_WORKERS', os.cpu_count() or 1))
+
+    @cached_property
+    def scoring_pool(self):
+        """
+        A process pool holding shards of the records, or None when the corpus is too
+        small (or lazily loaded) for parallel scoring to pay off.
+        """
+        if self.lazy or self.scoring_workers < 2 or len(self.records) < self.PARALLEL_MIN_RECORDS:
+            return None
+        from .parallel import ScoringPool
+        return ScoringPool(self.store, self.scoring_workers)
+
+    def score(self, records, expr, field):
+        """
+        Returns row id -> score of expr against field for records, and row id -> the
+        (first_line, last_line) of the best matching code window.  Lines are only
+        known in chunked mode.
+        """
+        if self.chunked and field in ('code', 'text'):
+            return self.score_windows(records, expr, field)
+
+        pool = self.scoring_pool
+        if pool and field in pool.FIELDS + ('text',):
+            return pool.score(records, field, expr, self.scorer), {}
+        return self.scorer.score(expr, self.field_values(records, field)), {}
+
+    @cached_property
+    def chunked(self):
+        return bool(self.settings.get('CHUNKED_CODE', False))
+
+    @cached_property
+    def code_windows(self):
+        # row id -> line windows of the record's code, filled in as records are scored
+        return {}
+
+    def record_windows(self, records):
+        """
+        Maps row id to the line windows of each record's code.  Windows of loaded code
+        are kept for later queries, lazy code is split as it is read.
+        """
+        if self.lazy:
+            codes = self.field_values(records, 'code')
+            return {row_id: line_windows(code, self.CHUNK_LINES, self.CHUNK_OVERLAP) for row_id, code in codes.items()}
+
+        windows = self.code_windows
+        codes = self.store.columns['code']
+        for row_id in records:
+            if row_id not in windows:
+                windows[row_id] = line_windows(codes[row_id], self.CHUNK_LINES, self.CHUNK_OVERLAP)
+        return windows
+
+    @cached_property
+    def text_windows(self):
+        # row id -> search text of each of the record's line windows, built once per record
+        return {}
+
+    def record_text_windows(self, records, windows):
+        """
+        Maps row id to the search text of each line window: the record's file name and
+        description with the window's code, normalized like a whole record's text.
+        """
+        texts = {} if self.lazy else self.text_windows
+        for row_id in records:
+            if row_id not in texts:
+                row = self.store.row(row_id)
+                texts[row_id] = [self.make_text(row, code) for _, _, code in windows[row_id]]
+        return texts
+
+    def score_windows(self, records, expr, field):
+        """
+        Scores every line window of code on its own so that long files cost no more
+        per character than short ones.  A record gets its best window's score.
+        """
+        windows = self.record_windows(records)
+        if field == 'code':
+            values = {row_id: [code for _, _, code in windows[row_id]] for row_id in records}
+        else:
+            values = self.record_text_windows(records, windows)
+        choices = {}
+        for row_id in records:
+            for ind, value in enumerate(values[row_id]):
+                choices[row_id, ind] = value
+
+        best = {}
+        for (row_id, ind), score in self.scorer.score(expr, choices).items():
+            best[row_id] = max(best.get(row_id, (score, -ind)), (score, -ind))
+
+        scores = {row_id: score for row_id, (score, _) in best.items()}
+        lines = {row_id: windows[row_id][-neg_ind][:2] for row_id, (_, neg_ind) in best.items()}
+        return scores, lines
+
+    @cached_property
+    def weighted(self):
+        return bool(self.settings.get('WEIGHTED_RANKING', False))
+
+    @cached_property
+    def field_weights(self):
+        weights = dict(self.FIELD_WEIGHTS)
+        weights.update(self.settings.get('FIELD_WEIGHTS', {}))
+        return weights
+
+    @cached_property
+    def lazy(self):
+        return bool(self.settings.get('LAZY_CODE', False))
+
+    @property
+    def record_columns(self):
+        columns = ['l.gist_id AS gid', 'l.description', 'l.file AS file_name', 'l.file_url', 'l.language']
+        if not self.lazy:
+            columns.append('c.code')
+        return ', '.join(columns)
+
+    @property
+    def records_source(self):
+        """
+        The tables records are read from.  The search table already holds the list
+        columns and the search text, so in lazy mode it is read on its own.
+        """
+        if not self.has_search_table:
+            return f'{Config.LIST_TABLE} as l join {Config.CODE_TABLE} as c on c.file_url = l.file_url'
+        if self.lazy:
+            return f'{Config.SEARCH_TABLE} as l'
+        return f'{Config.SEARCH_TABLE} as l join {Config.CODE_TABLE} as c on c.file_url = l.file_url'
+
+    @property
+    def record_fields(self):
+        if self.lazy:
+            return ('gid', 'description', 'file_name', 'file_url', 'language')
+        return ('gid', 'description', 'file_name', 'file_url', 'language', 'code', 'text')
+
+    @cached_property
+    def store(self):
+        """
+        Every record, column by column.  Records are ordered by file name and their
+        row id is their position in that order.
+        """
         if not self.has_tables:
-            return OrderedDict()
+            return RecordStore(self.record_fields)
+
+        columns = self.record_columns
+        if self.has_search_table and not self.lazy:
+            columns += ', l.text'
 
         cursor = self.db.query(
             f"""
                 select
-                    l.gist_id AS gid,
-                    l.description,
-                    l.file AS file_name,
-                    c.code
+                    {columns}
                 from
-                    {Config.LIST_TABLE} as l
-                join
-                    {Config.CODE_TABLE} as c
-                on
-                    c.file_url = l.file_url
+                    {self.records_source}
                 order by
                     file_name collate nocase asc,
-                    description asc
+                    description asc,
+                    l.file_url asc
             """
         )
-        raw_records = list(cursor)
-
-        out_recs = OrderedDict()
-        for rec in raw_records:
-            rec['text'] = '\n'.join(
-                [
-                    rec['file_name'],
-                    rec['description'],
-                    rec['code']
-                ]
+
+        store = RecordStore(self.record_fields)
+        for rec in cursor:
+            if not self.lazy and 'text' not in rec:
+                rec['text'] = self.make_text(rec, rec['code'])
+            store.append(rec)
+        return store
+
+    @cached_property
+    def records(self):
+        return RowSet(self.store, range(len(self.store)))
+
+    def make_text(self, rec, code):
+        return search_text(rec['file_name'], rec['description'], code)
+
+    @cached_property
+    def code_cache(self):
+        return OrderedDict()
+
+    def fetch_codes(self, file_urls):
+        codes = {}
+        for batch in chunked(file_urls, 500):
+            placeholders, params = in_params(batch)
+            cursor = self.db.query(
+                f'select file_url, code from {Config.CODE_TABLE} where file_url in ({placeholders})',
+                **params
             )
-            out_recs[rec['gid']] = rec
-        return out_recs
-
-    def rank(self, records, expr, field):
-        search_recs = OrderedDict((t[0], t[1][field]) for t in records.items())
-        tups = process.extract(expr, search_recs, limit=len(records) + 1)
-        out = OrderedDict()
-        for tup in tups:
-            gid = tup[2]
-            out[gid] = records[gid]
+            codes.update((r['file_url'], r['code']) for r in cursor)
+        return codes
+
+    def code(self, rec):
+        """
+        Returns the code for a record, reading it from the database in lazy mode.
+        """
+        if 'code' in rec:
+            return rec['code']
+
+        file_url = rec['file_url']
+        if file_url in self.code_cache:
+            self.code_cache.move_to_end(file_url)
+        else:
+            self.code_cache[file_url] = self.fetch_codes([file_url]).get(file_url, '')
+            if len(self.code_cache) > self.CODE_CACHE_SIZE:
+                self.code_cache.popitem(last=False)
+        return self.code_cache[file_url]
+
+    def field_values(self, records, field):
+        """
+        Maps row id to the value of field.  Lazy records get code loaded just for the
+        records being scored.
+        """
+        if not self.lazy or field not in ('code', 'text'):
+            return Column(self.store.columns[field], records)
+
+        file_urls = self.store.columns['file_url']
+        codes = self.fetch_codes([file_urls[row_id] for row_id in records])
+        out = {}
+        for row_id in records:
+            code = codes.get(file_urls[row_id], '')
+            out[row_id] = code if field == 'code' else self.make_text(self.store.row(row_id), code)
         return out
 
-    def filter_glob(self, expr, records):
-        out = OrderedDict()
-        for gid, rec in records.items():
-            if fnmatch(rec['file_name'], expr):
-                out[gid] = rec
+    @cached_property
+    def query_cache(self):
+        return OrderedDict()
+
+    def invalidate(self):
+        """
+        Drop loaded records and cached query results.  Call this after a sync.
+        """
+        pool = self.__dict__.pop('scoring_pool', None)
+        if pool:
+            pool.close()
+        names = [
+            'has_tables', 'has_trigrams', 'has_fts', 'search_backend', 'store', 'records', 'code_windows',
+            'text_windows', 'corpus_version', 'has_search_table', 'results_version', 'saved_queries',
+        ]
+        for name in names:
+            self.__dict__.pop(name, None)
+        self.query_cache.clear()
+        self.code_cache.clear()
+        self.refine_stacks.clear()
+
+    def candidate_file_urls(self, expr):
+        """
+        Returns the file_urls sharing enough trigrams with expr to be worth scoring,
+        or None when the index can't help (no index or a query under three characters).
+        """
+        grams = sorted(trigrams(expr))
+        if not grams or not self.has_trigrams:
+            return None
+
+        min_count = max(1, int(math.ceil(len(grams) * self.TRIGRAM_MIN_OVERLAP)))
+        placeholders, params = in_params(grams, 'g')
+        cursor = self.db.query(
+            f"""
+                select
+                    f.file_url
+                from (
+                    select
+                        file_id
+                    from
+                        {Config.TRIGRAM_TABLE}
+                    where
+                        gram in ({placeholders})
+                    group by
+                        file_id
+                    having
+                        count(*) >= :min_count
+                ) as g
+                join
+                    {Config.TRIGRAM_FILE_TABLE} as f
+                on
+                    f.file_id = g.file_id
+            """,
+            min_count=min_count,
+            **params
+        )
+        return {r['file_url'] for r in cursor}
+
+    def prune(self, records, expr):
+        file_urls = self.candidate_file_urls(expr)
+        if file_urls is None:
+            return records
+        return self.subset(records, lambda row_id: self.store.columns['file_url'][row_id] in file_urls)
+
+    def subset(self, records, keep):
+        """
+        Returns the records whose row id passes keep, in the same order.
+        """
+        return RowSet(self.store, [row_id for row_id in records if keep(row_id)])
+
+    @cached_property
+    def refine_stacks(self):
+        return OrderedDict()
+
+    def rank(self, records, expr, field, context=()):
+        """
+        Ranks records by the scorer's score of expr against field.  context identifies the
+        filters that produced records, and keys a stack of earlier (expr, scores, result)
+        rankings: a query extending the one on top only re-scores that query's good
+        matches, and a query equal to one on the stack (e.g. after backspace) is
+        answered from it.
+        """
+        stack = self.refine_stacks.setdefault((field, context), [])
+        self.refine_stacks.move_to_end((field, context))
+        if len(self.refine_stacks) > self.REFINE_CONTEXTS:
+            self.refine_stacks.popitem(last=False)
+        while stack and not expr.startswith(stack[-1][0]):
+            stack.pop()
+        if stack and stack[-1][0] == expr:
+            return stack[-1][2]
+
+        # Keep the match lines found by earlier rankings in the chain
+        lines = dict(getattr(records, 'lines', {}))
+        records = self.prune(records, expr)
+        if stack:
+            prev_scores = stack[-1][1]
+            records = self.subset(records, lambda row_id: prev_scores.get(row_id, 0) >= self.REFINE_MIN_SCORE)
+        if not records:
+            return records
+
+        scores, field_lines = self.score(records, expr, field)
+        lines.update(field_lines)
+        scored = [(scores[row_id], row_id) for row_id in records if row_id in scores]
+        out = Ranking(self.records, scored, self.TOP_K, lines)
+
+        stack.append((expr, out.scores, out))
+        del stack[:-self.REFINE_STACK_SIZE]
         return out
 
+    def weighted_rank(self, records, text_expr=None, desc_expr=None, file_expr=None, code_expr=None):
+        """
+        Ranks records in one pass by the weighted mean of per-field scores.  text_expr
+        is scored against every weighted field, the other expressions only against
+        their own field.
+        """
+        lines = dict(getattr(records, 'lines', {}))
+        terms = []
+        if text_expr:
+            terms.extend((field, text_expr) for field in self.field_weights)
+        for field, expr in [('description', desc_expr), ('file_name', file_expr), ('code', code_expr)]:
+            if expr:
+                terms.append((field, expr))
+
+        for expr in {expr for _, expr in terms}:
+            records = self.prune(records, expr)
+        if not records:
+            return records
+
+        combined = {}
+        total_weight = 0
+        for field, expr in terms:
+            weight = self.field_weights.get(field, 1)
+            total_weight += weight
+            scores, field_lines = self.score(records, expr, field)
+            lines.update(field_lines)
+            for row_id, score in scores.items():
+                combined[row_id] = combined.get(row_id, 0) + weight * score
+
+        scored = [(combined[row_id] / total_weight, row_id) for row_id in records if row_id in combined]
+        return Ranking(self.records, scored, self.TOP_K, lines)
+
+    def filter_glob(self, expr, records):
+        file_names = self.store.columns['file_name']
+        return self.subset(records, lambda row_id: fnmatch(file_names[row_id], expr))
+
     def get(self, *, glob_expr=None, text_expr=None, desc_expr=None, file_expr=None, code_expr=None):
+        key = (glob_expr, text_expr, desc_expr, file_expr, code_expr)
+        if key in self.query_cache:
+            self.query_cache.move_to_end(key)
+            return self.query_cache[key]
+
+        records = self.load_saved_query(key)
+        if records is None:
+            records = self._get(*key)
+
+        self.query_cache[key] = records
+        if len(self.query_cache) > self.QUERY_CACHE_SIZE:
+            self.query_cache.popitem(last=False)
+        return records
+
+    def result_rows(self, records, fields, limit=None, offset=0):
+        """
+        Yields a dict of the requested fields for each of limit results (all of them if
+        limit is None) starting at offset, best first.  Only the results being yielded
+        are ordered, and code is only read for them.  Besides RESULT_FIELDS, 'id' gives
+        the row id.
+        """
+        scores = getattr(records, 'scores', {})
+        lines = getattr(records, 'lines', {})
+        stop = None if limit is None else offset + limit
+        for row_id in itertools.islice(records, offset, stop):
+            row = records[row_id]
+            out = {}
+            for field in fields:
+                if field == 'id':
+                    out[field] = row_id
+                elif field == 'code':
+                    out[field] = self.code(row)
+                elif field == 'score':
+                    out[field] = scores.get(row_id)
+                elif field == 'lines':
+                    out[field] = lines.get(row_id)
+                else:
+                    out[field] = row[field]
+            yield out
+
+    @cached_property
+    def results_version(self):
+        """
+        Identifies the corpus and every setting that affects ranking, so saved results
+        are only reused when a fresh search would rank the same way.  None when the
+        database predates corpus versions.
+        """
+        if self.corpus_version is None:
+            return None
+        settings = [
+            self.corpus_version, self.search_backend, self.scorer.name, self.scorer.score_cutoff,
+            self.weighted, self.field_weights, self.chunked, self.CHUNK_LINES, self.CHUNK_OVERLAP,
+        ]
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    @cached_property
+    def saved_queries(self):
+        # key -> saved row for the rankings kept by the last session, oldest first
+        if not self.has_tables or Config.QUERY_TABLE not in self.db.tables:
+            return OrderedDict()
+        return OrderedDict(
+            (tuple(json.loads(row['key'])), row) for row in self.query_table.find(order_by='position')
+        )
+
+    def load_saved_query(self, key):
+        """
+        Returns the ranking a previous session saved for key, or None if there is none
+        for the current corpus and settings.
+        """
+        row = self.saved_queries.get(key)
+        if row is None or row['version'] != self.results_version:
+            return None
+
+        result = json.loads(row['result'])
+        scored = [(score, row_id) for row_id, score in result['scores']]
+        lines = {int(row_id): tuple(lines) for row_id, lines in result['lines'].items()}
+        return Ranking(self.records, scored, self.TOP_K, lines)
+
+    def save_query_cache(self):
+        """
+        Saves the most recently used rankings (this session's, then the last one's) so
+        the next session can answer them without searching.  Nothing is saved while a
+        sync is running or once one has replaced the database.
+        """
+        version = self.results_version
+        if version is None:
+            return
+
+        rows = OrderedDict(
+            (key, dict(key=row['key'], version=version, result=row['result']))
+            for key, row in self.saved_queries.items() if row['version'] == version
+        )
+        for key, result in self.query_cache.items():
+            if isinstance(result, Ranking):
+                blob = dict(scores=list(result.scores.items()), lines=result.lines)
+                rows.pop(key, None)
+                rows[key] = dict(key=json.dumps(key), version=version, result=json.dumps(blob))
+
+        rows = list(rows.values())[-self.QUERY_PERSIST_SIZE:]
+        with self.sync_lock(wait=False) as locked:
+            # Rankings are only good for the file they came from, and a sync may have
+            # swapped it out.  Holding the lock keeps one from doing so mid-write.
+            if not locked or self.db_inode() != self.opened_db_inode:
+                return
+            with self.db as tx:
+                tx[Config.QUERY_TABLE].delete()
+                tx[Config.QUERY_TABLE].insert_many(
+                    [dict(row, position=position) for position, row in enumerate(rows)]
+                )
+
+    def fts_query(self, expr):
+        """
+        Translates a search expression into an FTS5 query.  "Quoted text" is kept as a
+        phrase and every other word becomes a prefix term.  Terms are ANDed together.
+        """
+        terms = []
+        for phrase, word in self.FTS_TOKEN_REX.findall(expr):
+            if phrase:
+                terms.append('"{}"'.format(phrase.replace('"', '""')))
+            else:
+                word = word.strip('"')
+                if word:
+                    terms.append('"{}"*'.format(word.replace('"', '""')))
+        return ' '.join(terms)
+
+    def fts_get(self, glob_expr, text_expr, desc_expr, file_expr, code_expr):
+        import sqlalchemy
+        clauses = []
+        column_exprs = [(None, text_expr), ('description', desc_expr), ('file_name', file_expr), ('code', code_expr)]
+        for column, expr in column_exprs:
+            query = self.fts_query(expr) if expr else ''
+            if query:
+                clauses.append(f'{column} : ({query})' if column else f'({query})')
+
+        weights = ', '.join(str(w) for w in self.FTS_WEIGHTS)
+        try:
+            cursor = self.db.query(
+                f"""
+                    select
+                        l.file_url
+                    from
+                        {Config.FTS_TABLE} as f
+                    join
+                        {Config.LIST_TABLE} as l
+                    on
+                        l.file_url = f.file_url
+                    join
+                        {Config.CODE_TABLE} as c
+                    on
+                        c.file_url = f.file_url
+                    where
+                        {Config.FTS_TABLE} match :match_expr
+                    order by
+                        bm25({Config.FTS_TABLE}, {weights})
+                """,
+                match_expr=' AND '.join(clauses)
+            )
+            ids_by_file_url = self.store.ids_by_file_url
+            records = RowSet(self.store, [ids_by_file_url[r['file_url']] for r in cursor])
+        except sqlalchemy.exc.OperationalError:
+            # Half-typed queries can be invalid FTS syntax
+            records = RowSet(self.store, [])
+
+        if glob_expr and records:
+            records = self.filter_glob(glob_expr, records)
+        return records
+
+    def _get(self, glob_expr, text_expr, desc_expr, file_expr, code_expr):
+        if self.search_backend == 'fts' and any([text_expr, desc_expr, file_expr, code_expr]):
+            return self.fts_get(glob_expr, text_expr, desc_expr, file_expr, code_expr)
+
         records = self.records
         if glob_expr and records:
             records = self.filter_glob(glob_expr, records)
 
+        if self.weighted and records and any([text_expr, desc_expr, file_expr, code_expr]):
+            return self.weighted_rank(records, text_expr, desc_expr, file_expr, code_expr)
+
         if text_expr and records:
-            records = self.rank(records, text_expr, 'text')
+            records = self.rank(records, text_expr, 'text', (glob_expr,))
 
         if desc_expr and records:
-            records = self.rank(records, desc_expr, 'description')
+            records = self.rank(records, desc_expr, 'description', (glob_expr, text_expr))
 
         if file_expr and records:
-            records = self.rank(records, file_expr, 'file_name')
+            records = self.rank(records, file_expr, 'file_name', (glob_expr, text_expr, desc_expr))
 
         if code_expr and records:
-            records = self.rank(records, code_expr, 'code')
+            records = self.rank(records, code_expr, 'code', (glob_expr, text_expr, desc_expr, file_expr))
 
         return records
@@ -0,0 +1,86 @@
+import math
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from .scorers import get_scorer
+from .utils import search_text
+
+# The shard of records owned by this worker process
+_shard = None
+
+
+def _load_shard(shard):
+    global _shard
+    shard['text'] = [
+        search_text(file_name, description, code)
+        for file_name, description, code in zip(shard['file_name'], shard['description'], shard['code'])
+    ]
+    _shard = shard
+
+
+def _score_shard(field, expr, indices, scorer_name, score_cutoff):
+    values = _shard[field]
+    if indices is None:
+        indices = range(len(values))
+    scores = get_scorer(scorer_name, score_cutoff).score(expr, {ind: values[ind] for ind in indices})
+
+    # A compact array is much cheaper to send back than a dict.  -1 marks unscored.
+    out = array('d', [-1.]) * len(values)
+    for ind, score in scores.items():
+        out[ind] = score
+    return out
+
+
+class ScoringPool:
+    """
+    Scores records on several processes.  The store is split into one shard of
+    consecutive rows per worker, and each shard is sent to its worker once when the
+    pool starts, so a query only ships the expression (and candidate rows) out and
+    an array of scores back.
+    """
+    FIELDS = ('file_name', 'description', 'code')
+
+    def __init__(self, store, num_workers):
+        self.num_records = len(store)
+        self.shard_size = max(1, int(math.ceil(self.num_records / num_workers)))
+
+        # Spawned workers are safe to start from the TUI's search thread
+        context = multiprocessing.get_context('spawn')
+        self.executors = []
+        for start in range(0, self.num_records, self.shard_size):
+            shard_data = {field: store.columns[field][start:start + self.shard_size] for field in self.FIELDS}
+            self.executors.append(
+                ProcessPoolExecutor(1, mp_context=context, initializer=_load_shard, initargs=(shard_data,))
+            )
+
+    def score(self, records, field, expr, scorer):
+        """
+        Returns row id -> score for records, like Scorer.score does.
+        """
+        if len(records) == self.num_records:
+            shard_indices = [None] * len(self.executors)
+        else:
+            shard_indices = [[] for _ in self.executors]
+            for row_id in records:
+                shard_indices[row_id // self.shard_size].append(row_id % self.shard_size)
+
+        futures = {
+            shard_ind: self.executors[shard_ind].submit(
+                _score_shard, field, expr, indices, scorer.name, scorer.score_cutoff
+            )
+            for shard_ind, indices in enumerate(shard_indices)
+            if indices is None or indices
+        }
+        results = {shard_ind: future.result() for shard_ind, future in futures.items()}
+
+        scores = {}
+        for row_id in records:
+            score = results[row_id // self.shard_size][row_id % self.shard_size]
+            if score >= 0:
+                scores[row_id] = score
+        return scores
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,109 @@
+import sys
+from collections.abc import Mapping
+
+from .utils import cached_property
+
+
+class Row:
+    """
+    A view of one row of a RecordStore.  It reads like the dict the row would
+    otherwise be, but holds nothing except the store and the row id.
+    """
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, row_id):
+        self.store = store
+        self.id = row_id
+
+    def __getitem__(self, field):
+        return self.store.columns[field][self.id]
+
+    def __contains__(self, field):
+        return field in self.store.columns
+
+    def get(self, field, default=None):
+        return self[field] if field in self else default
+
+    def keys(self):
+        return self.store.columns.keys()
+
+    def __repr__(self):
+        return 'Row({}, {!r})'.format(self.id, self['file_name'])
+
+
+class RecordStore:
+    """
+    Records held column-wise, one list per field.  A record's integer row id is its
+    position in every list.  Gist ids, descriptions, file names and languages are
+    interned, so records repeating one share a single copy.
+    """
+    INTERNED = ('gid', 'description', 'file_name', 'language')
+
+    def __init__(self, fields):
+        self.columns = {field: [] for field in fields}
+
+    def append(self, rec):
+        for field, column in self.columns.items():
+            value = rec[field]
+            if field in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            column.append(value)
+
+    def __len__(self):
+        return len(self.columns['file_url'])
+
+    def row(self, row_id):
+        return Row(self, row_id)
+
+    @cached_property
+    def ids_by_file_url(self):
+        return {file_url: row_id for row_id, file_url in enumerate(self.columns['file_url'])}
+
+
+class RowSet(Mapping):
+    """
+    A read-only mapping of row id -> Row over some of a store's rows, in the order
+    of ids.  Filtering makes a new RowSet over a list of ids; no rows are copied.
+    """
+    def __init__(self, store, ids):
+        self.store = store
+        self.ids = ids
+
+    @cached_property
+    def _id_set(self):
+        return set(self.ids)
+
+    def __contains__(self, row_id):
+        if isinstance(self.ids, range):
+            return row_id in self.ids
+        return row_id in self._id_set
+
+    def __getitem__(self, row_id):
+        if row_id not in self:
+            raise KeyError(row_id)
+        return self.store.row(row_id)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Column(Mapping):
+    """
+    A read-only mapping of row id -> value of one column for the ids given.  This is
+    what scorers get as their choices, so scoring doesn't build a dict per query.
+    """
+    def __init__(self, values, ids):
+        self.values = values
+        self.ids = ids
+
+    def __getitem__(self, row_id):
+        return self.values[row_id]
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,95 @@
+import re
+
+
+class Scorer:
+    """
+    Scores a query against a mapping of key -> text.  score() returns a dict of
+    key -> score (0 to 100) holding the choices that scored at least score_cutoff.
+    """
+    name = None
+
+    def __init__(self, score_cutoff=0):
+        self.score_cutoff = score_cutoff
+
+    def score(self, query, choices):
+        raise NotImplementedError
+
+
+class FuzzywuzzyScorer(Scorer):
+    """
+    fuzzywuzzy's WRatio, scoring one choice at a time in python.
+    """
+    name = 'fuzzywuzzy'
+
+    def score(self, query, choices):
+        from fuzzywuzzy import process
+        return {
+            key: score for _, score, key in process.extractWithoutOrder(query, choices)
+            if score >= self.score_cutoff
+        }
+
+
+class RapidfuzzScorer(Scorer):
+    """
+    rapidfuzz's WRatio over the whole batch of choices in C.  Scores closely track
+    fuzzywuzzy's but are floats.
+    """
+    name = 'rapidfuzz'
+
+    def score(self, query, choices):
+        try:
+            from rapidfuzz import fuzz, process, utils
+        except ImportError:
+            raise ImportError('The rapidfuzz scorer needs rapidfuzz.  Run: pip install rapidfuzz')
+
+        matches = process.extract(
+            query,
+            choices,
+            scorer=fuzz.WRatio,
+            processor=utils.default_process,
+            limit=None,
+            score_cutoff=self.score_cutoff,
+        )
+        return {key: score for _, score, key in matches}
+
+
+class SubstringScorer(Scorer):
+    """
+    Case-insensitive matching of each word of the query as a regex (or as literal
+    text when it isn't a valid regex).  A choice containing the whole query scores
+    100, otherwise it scores the percentage of words found.  Choices matching
+    nothing, including missing (None) values, are always left out.
+    """
+    name = 'substring'
+
+    def compile(self, text):
+        try:
+            return re.compile(text, re.IGNORECASE)
+        except re.error:
+            return re.compile(re.escape(text), re.IGNORECASE)
+
+    def score(self, query, choices):
+        whole = self.compile(query)
+        words = [self.compile(word) for word in query.split()] or [whole]
+
+        scores = {}
+        for key, text in choices.items():
+            if text is None:
+                # e.g. a gist without a description
+                continue
+            if whole.search(text):
+                score = 100
+            else:
+                score = 100 * sum(1 for word in words if word.search(text)) // len(words)
+            if score and score >= self.score_cutoff:
+                scores[key] = score
+        return scores
+
+
+SCORERS = {klass.name: klass for klass in [FuzzywuzzyScorer, RapidfuzzScorer, SubstringScorer]}
+
+
+def get_scorer(name, score_cutoff=0):
+    if name not in SCORERS:
+        raise ValueError('Unknown scorer {!r}.  Choose from {}'.format(name, ', '.join(SCORERS)))
+    return SCORERS[name](score_cutoff=score_cutoff)
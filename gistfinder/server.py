@@ -0,0 +1,262 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from .loader import Loader
+
+
+class ServerError(Exception):
+    pass
+
+
+def request(socket_file, message):
+    """
+    Sends one request to a gf serve process and yields its replies.  Connecting
+    happens right away, so a missing server raises OSError before anything is
+    yielded.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_file)
+        sock.sendall(json.dumps(message).encode() + b'\n')
+    except OSError:
+        sock.close()
+        raise
+    return _replies(sock)
+
+
+def _replies(sock):
+    with sock, sock.makefile('rb') as buff:
+        for line in buff:
+            reply = json.loads(line)
+            if 'error' in reply:
+                raise ServerError(reply['error'])
+            yield reply
+
+
+class SearchHandler(socketserver.StreamRequestHandler):
+    """
+    Answers one request per connection.  A request is a line of JSON and the reply is
+    lines of JSON, ended by closing the connection.  A failed request is answered
+    with a single {"error": ...} line.
+    """
+    def write(self, reply):
+        self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+    def handle(self):
+        try:
+            for reply in self.server.answer(json.loads(self.rfile.readline())):
+                self.write(reply)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self.write({'error': '{}: {}'.format(type(e).__name__, e)})
+
+
+class SearchServer(socketserver.UnixStreamServer):
+    """
+    Keeps a loader warm and answers searches from gf and gf search over a unix
+    socket.  Requests are answered one at a time, so the loader's caches are never
+    shared between threads.
+
+    Whenever the database or settings file changes, a new loader is built in the
+    background and swapped in once its records are loaded.  Until then, and for
+    good if the corpus version and settings turn out to be the same (e.g. a sync
+    that found nothing new), the current loader keeps answering.
+    """
+    def __init__(self, loader_class=Loader, socket_file=None):
+        self.loader_class = loader_class
+        self.loaded_stamp = self.stamp()
+        self.loader = self.warm(loader_class())
+        self.reloading = None
+        self.reload_executor = ThreadPoolExecutor(max_workers=1)
+        super().__init__(socket_file or loader_class.socket_file, SearchHandler)
+        os.chmod(self.server_address, 0o600)
+
+    def stamp(self):
+        # Syncs swap in a new database file, and databases from older versions are in
+        # WAL mode, where writes show up in the -wal file before the database itself
+        db_file = self.loader_class.db_file
+        stamps = []
+        for path in [db_file, db_file + '-wal', self.loader_class.auth_file]:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return stamps
+
+    def warm(self, loader):
+        loader.records
+        loader.scoring_pool
+        return loader
+
+    def reload(self, current):
+        loader = self.loader_class()
+        if loader.corpus_version is None or loader.corpus_version != current.corpus_version:
+            return self.warm(loader)
+        if loader.settings != current.settings:
+            return self.warm(loader)
+        return current
+
+    def current_loader(self):
+        if self.reloading is not None and self.reloading.done():
+            loader = self.reloading.result()
+            self.reloading = None
+            if loader is not self.loader:
+                self.loader.invalidate()
+                self.loader = loader
+
+        stamp = self.stamp()
+        if stamp != self.loaded_stamp and self.reloading is None:
+            self.loaded_stamp = stamp
+            self.reloading = self.reload_executor.submit(self.reload, self.loader)
+        return self.loader
+
+    def answer(self, request):
+        loader = self.current_loader()
+        op = request.get('op')
+        if op == 'ping':
+            yield {'version': loader.corpus_version, 'records': len(loader.records)}
+        elif op == 'search':
+            records = loader.get(**request.get('query', {}))
+            yield {'count': len(records)}
+            yield from loader.result_rows(records, request['fields'], request.get('limit'), request.get('offset', 0))
+        elif op == 'code':
+            row_id = loader.store.ids_by_file_url.get(request['file_url'])
+            yield {'code': loader.code(loader.records[row_id]) if row_id is not None else ''}
+        else:
+            raise ValueError('Unknown op {!r}'.format(op))
+
+    def server_close(self):
+        super().server_close()
+        self.reload_executor.shutdown(wait=False)
+        self.loader.save_query_cache()
+        self.loader.invalidate()
+
+
+def serve(loader_class=Loader, sync=False):
+    socket_file = loader_class.socket_file
+    if os.path.exists(socket_file):
+        if RemoteLoader.connect(socket_file):
+            print('gf serve is already running on {}'.format(socket_file), file=sys.stderr)
+            sys.exit(1)
+        # Left behind by a server that didn't shut down cleanly
+        os.unlink(socket_file)
+
+    server = SearchServer(loader_class, socket_file)
+    if sync:
+        # The server picks up each sync's database when it is swapped in
+        from .sync import Updater
+        threading.Thread(target=Updater().watch, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    print('Serving searches on {}'.format(socket_file), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_file)
+
+
+class RemoteRow(dict):
+    @property
+    def id(self):
+        return self['id']
+
+
+class RemoteResult(Mapping):
+    """
+    The results of a search run by gf serve, read like a Ranking.  Rows arrive a
+    page at a time as iteration reaches them.
+    """
+    FIELDS = ('id', 'gid', 'file_name', 'description', 'file_url', 'language', 'score', 'lines')
+
+    def __init__(self, loader, query):
+        self.loader = loader
+        self.query = query
+        self.scores = {}
+        self.lines = {}
+        self._ids = []
+        self._rows = {}
+        self._count = 0
+        self._fetch()
+
+    def _fetch(self):
+        replies = self.loader.request(dict(
+            op='search', query=self.query, fields=self.FIELDS, offset=len(self._ids), limit=self.loader.TOP_K
+        ))
+        self._count = next(replies)['count']
+        num_ids = len(self._ids)
+        for reply in replies:
+            row = RemoteRow(reply)
+            self._ids.append(row.id)
+            self._rows[row.id] = row
+            self.scores[row.id] = row['score']
+            if row['lines']:
+                self.lines[row.id] = tuple(row['lines'])
+        return len(self._ids) > num_ids
+
+    def __iter__(self):
+        ind = 0
+        while ind < len(self._ids) or (len(self._ids) < self._count and self._fetch()):
+            yield self._ids[ind]
+            ind += 1
+
+    def __getitem__(self, row_id):
+        return self._rows[row_id]
+
+    def __contains__(self, row_id):
+        return row_id in self._rows
+
+    def __len__(self):
+        return self._count
+
+
+class RemoteLoader:
+    """
+    Stands in for a Loader by asking a running gf serve, so gf and gf search don't
+    have to load anything themselves.
+    """
+    TOP_K = Loader.TOP_K
+    has_tables = True
+    scoring_pool = None
+
+    def __init__(self, socket_file):
+        self.socket_file = socket_file
+
+    @classmethod
+    def connect(cls, socket_file):
+        """
+        Returns a RemoteLoader if a server is answering on socket_file, else None.
+        """
+        try:
+            list(request(socket_file, {'op': 'ping'}))
+        except (OSError, ServerError):
+            return None
+        return cls(socket_file)
+
+    def request(self, message):
+        return request(self.socket_file, message)
+
+    def get(self, **query):
+        return RemoteResult(self, query)
+
+    def search_rows(self, query, fields, limit=None):
+        replies = self.request(dict(op='search', query=query, fields=fields, limit=limit))
+        next(replies)
+        return replies
+
+    def code(self, row):
+        return next(self.request({'op': 'code', 'file_url': row['file_url']}))['code']
+
+    def save_query_cache(self):
+        # The server saves its own rankings when it stops
+        pass
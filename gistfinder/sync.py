@@ -1,42 +1,194 @@
+import hashlib
+import itertools
+import json
 import os
 import requests
-import math
+import sqlalchemy
+import sqlite3
+import threading
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import parse_qs, urlencode, urlparse
 from tqdm import tqdm
 import sys
 from .config import Config
+from .utils import cached_property, chunked, in_params, search_text, trigrams
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket.  Tokens refill at `rate` per second up to `capacity`.
+    When a response carries GitHub's X-RateLimit headers, the refill rate is lowered
+    so the remaining quota is spread out until the limit resets.
+    """
+    def __init__(self, rate, capacity=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+
+        seconds_to_reset = max(1., float(reset) - time.time())
+        with self.lock:
+            self._refill()
+            self.rate = min(self.max_rate, max(int(remaining), 1) / seconds_to_reset)
+            if int(remaining) <= 0:
+                self.tokens = 0
 
 
 class Updater(Config):
-    PER_PAGE = 99
-    MAX_GISTS = 10_000
-
-    def blob_generator(self):
-        for page in range(int(math.ceil(self.MAX_GISTS / self.PER_PAGE))):
-            params = {
-                'per_page': self.PER_PAGE,
-                'page': page,
-            }
-            headers = {
-                'Authorization': f'token {self.github_token}',
-                'accept': 'application/vnd.github.v3+json'
-            }
-            resp = requests.get(self.user_url, params=params, headers=headers)
-            self.latest_resp = resp
-            blobs = resp.json()
-            if blobs:
-                yield blobs
-            else:
-                break
-
-    def get_list(self):
-        rec_list = []
-        for ll in self.blob_generator():
-            rec_list.extend(ll)
-
-        return rec_list
-
-    def get_parsed_blob_list(self):
+    PER_PAGE = 100
+
+    DOWNLOAD_WORKERS = 8
+    REQUESTS_PER_SECOND = 20
+    INSERT_BATCH_SIZE = 100
+    SYNC_INTERVAL = 30 * 60
+
+    @cached_property
+    def download_workers(self):
+        return int(self.settings.get('DOWNLOAD_WORKERS', self.DOWNLOAD_WORKERS))
+
+    @cached_property
+    def sync_interval(self):
+        return int(self.settings.get('SYNC_INTERVAL', self.SYNC_INTERVAL))
+
+    @property
+    def staging_file(self):
+        return self.db_file + '.sync'
+
+    @cached_property
+    def session(self):
+        # One keep-alive connection pool shared by all download threads
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.download_workers)
+        session.mount('https://', adapter)
+        return session
+
+    @cached_property
+    def rate_limiter(self):
+        # Paces api.github.com requests, which use up the quota its headers report
+        return RateLimiter(self.REQUESTS_PER_SECOND)
+
+    @cached_property
+    def download_limiter(self):
+        # Raw file downloads don't count against the API quota, so they keep the fixed rate
+        return RateLimiter(self.REQUESTS_PER_SECOND)
+
+    @cached_property
+    def requested_page_urls(self):
+        # Listing pages asked for since the last update_list_table started
+        return set()
+
+    def blob_generator(self, since=None):
+        """
+        Yields pages of the gist listing in order.  The first page's Link header says
+        how many pages there are, and the rest are then fetched concurrently, with
+        download_workers pages in flight and each page let go once yielded.
+        """
+        params = {'per_page': self.PER_PAGE}
+        if since:
+            params['since'] = since
+
+        blobs, link = self.get_page(dict(params, page=1))
+        if not blobs:
+            return
+        yield blobs
+
+        pages = iter(range(2, self.get_last_page(link) + 1))
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            pending = deque(
+                executor.submit(self.get_page, dict(params, page=page))
+                for page in itertools.islice(pages, self.download_workers)
+            )
+            while pending:
+                blobs, _ = pending.popleft().result()
+                for page in itertools.islice(pages, 1):
+                    pending.append(executor.submit(self.get_page, dict(params, page=page)))
+                if blobs:
+                    yield blobs
+
+    def get_last_page(self, link):
+        for link_item in requests.utils.parse_header_links(link or ''):
+            if link_item.get('rel') == 'last':
+                query = parse_qs(urlparse(link_item['url']).query)
+                return int(query['page'][0])
+        return 1
+
+    def get_page(self, params):
+        """
+        Gets one page of the gist listing and its Link header with a conditional request.
+        Pages are cached with their ETag/Last-Modified, and a 304 reply (which doesn't
+        count against the rate limit) is answered from the cache.
+        """
+        page_url = '{}?{}'.format(self.user_url, urlencode(sorted(params.items())))
+        self.requested_page_urls.add(page_url)
+        cached = None
+        if self.PAGE_TABLE in self.db.tables:
+            cached = self.page_table.find_one(url=page_url)
+
+        headers = {
+            'Authorization': f'token {self.github_token}',
+            'accept': 'application/vnd.github.v3+json'
+        }
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        # Listing requests are what count against the quota and carry its headers
+        self.rate_limiter.acquire()
+        resp = self.session.get(self.user_url, params=params, headers=headers)
+        self.rate_limiter.update(resp.headers)
+        self.latest_resp = resp
+
+        if resp.status_code == 304 and cached:
+            return json.loads(cached['body']), cached['link']
+        if resp.status_code != 200:
+            # e.g. a 403 once the rate limit is used up, whose body is an error message
+            resp.raise_for_status()
+
+        blobs = resp.json()
+        if resp.status_code == 200:
+            self.page_table.upsert(
+                dict(
+                    url=page_url,
+                    etag=resp.headers.get('ETag'),
+                    last_modified=resp.headers.get('Last-Modified'),
+                    link=resp.headers.get('Link'),
+                    body=resp.text,
+                ),
+                ['url']
+            )
+        return blobs, resp.headers.get('Link')
+
+    def iter_gists(self, since=None):
+        for blobs in self.blob_generator(since=since):
+            yield from blobs
+
+    def parse_gist(self, item):
         keys = [
             'url',
             'id',
@@ -45,77 +197,471 @@ class Updater(Config):
             'updated_at',
 
         ]
-        records = []
-
-        for item in self.get_list():
-            record_template = {k: item[k] for k in keys}
-            for file in item['files'].values():
-                record = record_template.copy()
-                record['file'] = file['filename']
-                record['language'] = file.get('language', 'unkown')
-                record['file_url'] = file['raw_url']
-                record['size'] = file.get('size', 0)
-                record['gist_id'] = record.pop('id')
-                records.append(record)
-
-        dedup = {r['file_url']: r for r in records}
-        records = list(dedup.values())
-        records = [r for r in records if not r['file'].endswith('ipynb')]
-
-        return records
-
-    def update_list_table(self):
-        recs = self.get_parsed_blob_list()
+        record_template = {k: item[k] for k in keys}
+        for file in item['files'].values():
+            record = record_template.copy()
+            record['file'] = file['filename']
+            record['language'] = file.get('language', 'unkown')
+            record['file_url'] = file['raw_url']
+            record['size'] = file.get('size', 0)
+            record['gist_id'] = record.pop('id')
+            yield record
+
+    def iter_file_records(self, since=None, seen=None):
+        """
+        Streams deduplicated file records off the gist listing.  The file_urls
+        yielded are added to the seen set.
+        """
+        seen = set() if seen is None else seen
+        for item in self.iter_gists(since=since):
+            for record in self.parse_gist(item):
+                if record['file_url'] in seen or record['file'].endswith('ipynb'):
+                    continue
+                seen.add(record['file_url'])
+                yield record
+
+    def replace_rows(self, tx, table_name, rows, fresh=False):
+        """
+        Writes whole rows keyed by file_url, replacing any already there.  This is a
+        delete and an insert per batch rather than upsert_many's lookup per row, and
+        just the insert when the table can't hold any of the rows yet.
+        """
+        if not fresh:
+            tx[table_name].delete(file_url={'in': [r['file_url'] for r in rows]})
+        tx[table_name].insert_many(rows)
+
+    def update_list_table(self, full=False):
+        """
+        Upserts list rows for gists updated since the last sync, one transaction per
+        batch as the listing streams in.  Only a full sync (the first one, or
+        full=True) can see and remove deleted gists.
+        """
         table = self.list_table
-        table.drop()
-        table.insert_many(recs)
+        fresh = self.LIST_TABLE not in self.db.tables
+        if fresh:
+            full = True
+        else:
+            table.create_index(['file_url'])
+        since = None if full else self.get_meta('since')
+
+        self.requested_page_urls = set()
+        seen_file_urls = set()
+        gist_ids = set()
+        high_water_mark = self.get_meta('since', '')
+        for batch in chunked(self.iter_file_records(since=since, seen=seen_file_urls), self.INSERT_BATCH_SIZE):
+            with self.db as tx:
+                self.replace_rows(tx, self.LIST_TABLE, batch, fresh=fresh)
+            gist_ids.update(r['gist_id'] for r in batch)
+            high_water_mark = max([high_water_mark] + [r['updated_at'] for r in batch])
+
+        if full:
+            stale_file_urls = {r['file_url'] for r in table.all()} - seen_file_urls
+        else:
+            # Files renamed or removed from a gist that changed
+            stale_file_urls = set()
+            for batch in chunked(gist_ids, self.INSERT_BATCH_SIZE):
+                stale_file_urls.update(r['file_url'] for r in table.find(gist_id={'in': batch}))
+            stale_file_urls -= seen_file_urls
+
+        for batch in chunked(stale_file_urls, self.INSERT_BATCH_SIZE):
+            table.delete(file_url={'in': batch})
         table.create_index(['file_url'])
+        table.create_index(['gist_id'])
+        self.prune_page_table()
+
+        # Advance the high-water mark only to what the API actually reported, so an
+        # unchanged account keeps asking the same question
+        if high_water_mark:
+            self.set_meta('since', high_water_mark)
+
+    def prune_page_table(self):
+        """
+        Deletes cached pages this listing didn't ask for, e.g. those of an older since
+        parameter, which would never be requested again.
+        """
+        if self.PAGE_TABLE not in self.db.tables:
+            return
+        cached_urls = {r['url'] for r in self.db.query(f'select url from {self.PAGE_TABLE}')}
+        for batch in chunked(cached_urls - self.requested_page_urls, self.INSERT_BATCH_SIZE):
+            self.page_table.delete(url={'in': batch})
 
     def get_lookup_dict(self, table):
-        return {r['file_url']: r for r in table.all()}
+        # Only the bookkeeping columns, so code bodies never get loaded here
+        columns = [c for c in ['file_url', 'updated_at'] if c in table.columns]
+        if 'file_url' not in columns:
+            return {}
+        cursor = self.db.query('select {} from {}'.format(', '.join(columns), table.name))
+        return {r['file_url']: r for r in cursor}
 
     def get_code(self, url):
-        resp = requests.get(url)
+        self.download_limiter.acquire()
+        resp = self.session.get(url)
         if resp.status_code == 200:
             return resp.text
         else:
             print(f'Problem retrieving {url}', file=sys.stderr)
             return None
 
+    def download_codes(self, file_urls):
+        """
+        Yields (file_url, code) as downloads finish.  Only twice download_workers
+        downloads are submitted at a time, and each is let go once yielded, so code
+        waiting to be written is at most a batch plus what is in flight.
+        """
+        file_urls = iter(file_urls)
+        max_pending = 2 * self.download_workers
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            pending = {}
+            while True:
+                for file_url in itertools.islice(file_urls, max_pending - len(pending)):
+                    pending[executor.submit(self.get_code, file_url)] = file_url
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
     def update_code_table(self, verbose=True):
-        #import pdb; pdb.set_trace()
         list_table = self.list_table
         code_table = self.code_table
 
         code_lookup = self.get_lookup_dict(code_table)
         list_lookup = self.get_lookup_dict(list_table)
 
-        missing_file_urls = set(list_lookup.keys()) - set(code_lookup.keys())
+        # Code is re-fetched whenever its gist was edited after the code was downloaded
+        stale_file_urls = {
+            file_url for file_url, rec in code_lookup.items()
+            if file_url in list_lookup and rec.get('updated_at') != list_lookup[file_url]['updated_at']
+        }
+        missing_file_urls = set(list_lookup.keys()) - set(code_lookup.keys()) | stale_file_urls
         deleted_file_urls = set(code_lookup.keys()) - set(list_lookup.keys())
 
         code_table.delete(file_url={'in': tuple(deleted_file_urls)})
+        self.delete_from_indexes(stale_file_urls)
+        if self.CODE_TABLE in self.db.tables:
+            code_table.create_index(['file_url'])
 
-        if not missing_file_urls:
+        if missing_file_urls:
+            downloads = self.download_codes(missing_file_urls)
+            if verbose:
+                downloads = tqdm(downloads, total=len(missing_file_urls))
+
+            records = (
+                dict(file_url=file_url, code=code, updated_at=list_lookup[file_url]['updated_at'])
+                for file_url, code in downloads if code
+            )
+            for batch in chunked(records, self.INSERT_BATCH_SIZE):
+                with self.db as tx:
+                    self.replace_rows(tx, self.CODE_TABLE, batch, fresh=not stale_file_urls)
+
+            code_table.create_index(['file_url'])
+
+    def delete_from_indexes(self, file_urls):
+        if not file_urls:
             return
+        file_urls = tuple(file_urls)
+        if self.has_trigram_schema():
+            self.delete_trigrams(file_urls)
+        if self.SEARCH_TABLE in self.db.tables:
+            self.search_table.delete(file_url={'in': file_urls})
+        if self.FTS_TABLE in self.db.tables:
+            with self.db as tx:
+                for batch in chunked(file_urls, self.INSERT_BATCH_SIZE):
+                    placeholders, params = in_params(batch)
+                    tx.query(f'delete from {Config.FTS_TABLE} where file_url in ({placeholders})', **params)
+
+    def update_fts_table(self):
+        """
+        Mirrors the joined list/code rows into an FTS5 table for the 'fts' search backend.
+        """
+        joined = f"""
+            select
+                l.file_url,
+                l.file,
+                l.description,
+                c.code
+            from
+                {Config.LIST_TABLE} as l
+            join
+                {Config.CODE_TABLE} as c
+            on
+                c.file_url = l.file_url
+        """
+        try:
+            with self.db as tx:
+                tx.query(
+                    f"""
+                        create virtual table if not exists {Config.FTS_TABLE}
+                        using fts5(file_url UNINDEXED, file_name, description, code)
+                    """
+                )
+                tx.query(
+                    f"""
+                        delete from {Config.FTS_TABLE}
+                        where file_url not in (select file_url from ({joined}))
+                    """
+                )
+                tx.query(
+                    f"""
+                        insert into {Config.FTS_TABLE} (file_url, file_name, description, code)
+                        select * from ({joined})
+                        where file_url not in (select file_url from {Config.FTS_TABLE})
+                    """
+                )
+        except sqlalchemy.exc.OperationalError:
+            print('Your sqlite build has no FTS5 support.  Skipping full-text index.', file=sys.stderr)
 
-        if verbose:
-            missing_file_urls = tqdm(missing_file_urls)
+    def drop_fts_table(self):
+        with self.db as tx:
+            tx.query(f'drop table if exists {self.FTS_TABLE}')
 
-        for file_url in missing_file_urls:
-            code = self.get_code(file_url)
-            if code:
-                code_table.insert(dict(file_url=file_url, code=code))
-                time.sleep(.1)
+    def has_trigram_schema(self):
+        return self.TRIGRAM_TABLE in self.db.tables and self.get_meta('trigram_schema') == self.TRIGRAM_SCHEMA
+
+    def drop_trigram_tables(self):
+        with self.db as tx:
+            for table in [self.TRIGRAM_TABLE, self.TRIGRAM_FILE_TABLE]:
+                tx.query(f'drop table if exists {table}')
+
+    def delete_trigrams(self, file_urls):
+        with self.db as tx:
+            for batch in chunked(file_urls, self.INSERT_BATCH_SIZE):
+                placeholders, params = in_params(batch)
+                tx.query(
+                    f"""
+                        delete from {Config.TRIGRAM_TABLE} where file_id in (
+                            select file_id from {Config.TRIGRAM_FILE_TABLE} where file_url in ({placeholders})
+                        )
+                    """,
+                    **params
+                )
+                tx.query(f'delete from {Config.TRIGRAM_FILE_TABLE} where file_url in ({placeholders})', **params)
+
+    def update_trigram_table(self):
+        """
+        Indexes the trigrams of each file's name, description and code.  Postings are
+        (gram, file_id) pairs in a WITHOUT ROWID table whose primary key is its only
+        index, and each file_url is stored once, in the file table, under its file_id.
+        """
+        if not self.has_trigram_schema():
+            self.drop_trigram_tables()
+            with self.db as tx:
+                tx.query(f"""
+                    create table {Config.TRIGRAM_FILE_TABLE} (
+                        file_id integer primary key,
+                        file_url text not null unique
+                    )
+                """)
+                tx.query(f"""
+                    create table {Config.TRIGRAM_TABLE} (
+                        gram text not null,
+                        file_id integer not null,
+                        primary key (gram, file_id)
+                    ) without rowid
+                """)
+            self.set_meta('trigram_schema', self.TRIGRAM_SCHEMA)
+
+        indexed_file_urls = {r['file_url'] for r in self.db.query(f'select file_url from {Config.TRIGRAM_FILE_TABLE}')}
+        joined = f"""
+            select
+                l.file_url,
+                l.description,
+                l.file AS file_name,
+                c.code
+            from
+                {Config.LIST_TABLE} as l
+            join
+                {Config.CODE_TABLE} as c
+            on
+                c.file_url = l.file_url
+        """
+        current_file_urls = {r['file_url'] for r in self.db.query(f'select file_url from ({joined})')}
+        self.delete_trigrams(indexed_file_urls - current_file_urls)
+
+        # Index a batch of files at a time so only one batch of code is ever in memory
+        for batch in chunked(current_file_urls - indexed_file_urls, self.INSERT_BATCH_SIZE):
+            placeholders, params = in_params(batch)
+            with self.db as tx:
+                tx[self.TRIGRAM_FILE_TABLE].insert_many([dict(file_url=file_url) for file_url in batch])
+                file_ids = {
+                    r['file_url']: r['file_id']
+                    for r in tx.query(
+                        f'select file_id, file_url from {Config.TRIGRAM_FILE_TABLE} where file_url in ({placeholders})',
+                        **params
+                    )
+                }
+                rows = []
+                for rec in tx.query(f'select * from ({joined}) where file_url in ({placeholders})', **params):
+                    text = '\n'.join([rec['file_name'], rec['description'] or '', rec['code']])
+                    file_id = file_ids[rec['file_url']]
+                    rows.extend(dict(gram=gram, file_id=file_id) for gram in trigrams(text))
+                tx[self.TRIGRAM_TABLE].insert_many(rows, chunk_size=10_000)
+
+    def corpus_version(self):
+        """
+        A hash of every synced file, when its gist was last updated and when its code
+        was downloaded.  It changes whenever a sync adds, edits or removes anything.
+        """
+        digest = hashlib.sha1()
+        # Code tables from before downloads were stamped have no updated_at
+        code_updated_at = 'c.updated_at' if 'updated_at' in self.code_table.columns else 'null'
+        cursor = self.db.query(
+            f"""
+                select
+                    l.file_url,
+                    l.updated_at,
+                    {code_updated_at} as code_updated_at
+                from
+                    {Config.LIST_TABLE} as l
+                join
+                    {Config.CODE_TABLE} as c
+                on
+                    c.file_url = l.file_url
+                order by
+                    l.file_url
+            """
+        )
+        for rec in cursor:
+            digest.update('{file_url} {updated_at} {code_updated_at}\n'.format(**rec).encode())
+        return digest.hexdigest()
+
+    def update_search_table(self, version):
+        """
+        Stores each file's normalized search text so the loader doesn't rebuild it at
+        startup, and stamps the table with the corpus version it was built for.
+        """
+        search_table = self.search_table
+        if self.SEARCH_TABLE in self.db.tables and self.get_meta('search_schema') != self.SEARCH_SCHEMA:
+            search_table.drop()
+
+        if self.SEARCH_TABLE in self.db.tables:
+            indexed_file_urls = {r['file_url'] for r in search_table.distinct('file_url')}
+        else:
+            indexed_file_urls = set()
 
-        code_table.create_index(['file_url'])
+        joined = f"""
+            select
+                l.gist_id,
+                l.description,
+                l.file,
+                l.file_url,
+                l.language,
+                c.code
+            from
+                {Config.LIST_TABLE} as l
+            join
+                {Config.CODE_TABLE} as c
+            on
+                c.file_url = l.file_url
+        """
+        current_file_urls = {r['file_url'] for r in self.db.query(f'select file_url from ({joined})')}
+
+        for batch in chunked(indexed_file_urls - current_file_urls, self.INSERT_BATCH_SIZE):
+            search_table.delete(file_url={'in': batch})
+
+        for batch in chunked(current_file_urls - indexed_file_urls, self.INSERT_BATCH_SIZE):
+            placeholders, params = in_params(batch)
+            rows = []
+            for rec in self.db.query(f'select * from ({joined}) where file_url in ({placeholders})', **params):
+                rec['text'] = search_text(rec['file'], rec['description'], rec.pop('code'))
+                rows.append(rec)
+            with self.db as tx:
+                tx[self.SEARCH_TABLE].insert_many(rows)
+
+        search_table.create_index(['file_url'])
+        self.set_meta('search_schema', self.SEARCH_SCHEMA)
+        self.set_meta('search_version', version)
+
+    def staging_db(self, fresh=False):
+        """
+        Copies the database to staging_file (or starts an empty one if fresh) and
+        connects to the copy.  Nothing reads the copy until it is swapped in, so it
+        skips fsyncs; a sync that dies leaves a copy the next sync throws away.
+        """
+        import dataset
+        for path in [self.staging_file, self.staging_file + '-journal']:
+            if os.path.isfile(path):
+                os.unlink(path)
+
+        if os.path.isfile(self.db_file) and not fresh:
+            source = sqlite3.connect(self.db_file)
+            dest = sqlite3.connect(self.staging_file)
+            try:
+                source.backup(dest)
+                # Swapped files must not depend on -wal and -shm files next to them
+                dest.execute('pragma journal_mode=delete')
+            finally:
+                source.close()
+                dest.close()
+
+        return dataset.connect(
+            url='sqlite:///{}'.format(self.staging_file), sqlite_wal_mode=False,
+            on_connect_statements=['pragma synchronous=off'],
+        )
 
     def reset(self):
-        if os.path.isfile(self.db_file):
-            print('Removing {}'.format(self.db_file), file=sys.stderr)
-            os.unlink(self.db_file)
-        self.sync()
+        # The live database stays in place for anything reading it until the new one is ready
+        self.sync(fresh=True)
+
+    def sync(self, full=False, fresh=False, wait=True):
+        """
+        Brings the database up to date.  The sync writes to a copy of the database that
+        then replaces it with os.replace, so gf, gf search and gf serve only ever see a
+        complete corpus.  Returns False without syncing if wait is False and another
+        sync is running.
+        """
+        with self.sync_lock(wait=wait) as locked:
+            if not locked:
+                print('Another sync is running, skipping this one', file=sys.stderr)
+                return False
+
+            live_db = self.__dict__.pop('db', None)
+            if live_db is not None:
+                live_db.close()
+
+            self.db = self.staging_db(fresh=fresh)
+            try:
+                self.sync_tables(full=full)
+            finally:
+                self.__dict__.pop('db').close()
+
+            with open(self.staging_file, 'rb+') as buff:
+                os.fsync(buff.fileno())
+            os.replace(self.staging_file, self.db_file)
 
-    def sync(self):
-        self.update_list_table()
-        self.update_code_table()
         print('\nSync Complete!', file=sys.stderr)
+        return True
+
+    def sync_tables(self, full=False):
+        self.update_list_table(full=full)
+        self.update_code_table()
+        # Each backend only needs its own index, and both are as big as the code table
+        backend = self.settings.get('SEARCH_BACKEND', 'fuzzy')
+        if backend == 'fuzzy':
+            self.update_trigram_table()
+        else:
+            self.drop_trigram_tables()
+        if backend == 'fts':
+            self.update_fts_table()
+        else:
+            self.drop_fts_table()
+
+        # Loaders only trust the search table and saved query results built for this version
+        version = self.corpus_version()
+        self.set_meta('corpus_version', version)
+        self.update_search_table(version)
+
+    def watch(self, interval=None, full=False):
+        """
+        Syncs every interval seconds (the sync interval setting by default) until
+        interrupted.  A round is skipped while another sync is running, and a round
+        that fails, e.g. on a dropped connection or an exhausted rate limit, is
+        reported and tried again next time.
+        """
+        interval = interval or self.sync_interval
+        while True:
+            try:
+                self.sync(full=full, wait=False)
+            except Exception as e:
+                print('Sync failed: {}: {}'.format(type(e).__name__, e), file=sys.stderr)
+            time.sleep(interval)
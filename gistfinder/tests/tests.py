@@ -1,4 +1,1015 @@
-from unittest import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stderr
+from unittest import TestCase, mock
+
+import dataset
+import requests
+
+from gistfinder.loader import Loader, Ranking
+from gistfinder.records import RowSet
+from gistfinder.scorers import get_scorer
+from gistfinder.server import RemoteLoader, SearchServer, ServerError
+from gistfinder.sync import RateLimiter, Updater
+from gistfinder.utils import line_windows, trigrams
+
+
+def make_records(n):
+    list_recs, code_recs = [], []
+    for ind in range(n):
+        file_url = f'https://gist.githubusercontent.com/user/{ind}/raw/file_{ind}.py'
+        list_recs.append(dict(
+            url=f'https://api.github.com/gists/{ind}',
+            gist_id=f'gist{ind}',
+            description=f'description number {ind}',
+            created_at='2020-01-01T00:00:00Z',
+            updated_at='2020-01-01T00:00:00Z',
+            file=f'file_{ind}.py',
+            language='Python',
+            file_url=file_url,
+            size=10,
+        ))
+        code_recs.append(dict(file_url=file_url, code=f'print("hello {ind}")'))
+    return list_recs, code_recs
+
+
+def row_id(loader, file_name):
+    return loader.store.columns['file_name'].index(file_name)
+
+
+class LoaderTestBase(TestCase):
+    num_records = 10
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.temp_dir, 'database.sqlite')
+
+        class TestLoader(Loader):
+            config_dir = self.temp_dir
+            db_url = f'sqlite:///{db_file}'
+
+            def _check_okay(self):
+                pass
+
+        class TestUpdater(Updater):
+            config_dir = self.temp_dir
+            db_url = f'sqlite:///{db_file}'
+
+            def _check_okay(self):
+                pass
+
+        for klass in [TestLoader, TestUpdater]:
+            klass.db_file = db_file
+            klass.auth_file = os.path.join(self.temp_dir, 'github_auth.json')
+            klass.socket_file = os.path.join(self.temp_dir, 'gistfinder.sock')
+        self.loader_class = TestLoader
+        self.updater_class = TestUpdater
+
+        list_recs, code_recs = make_records(self.num_records)
+        db = dataset.connect(url=TestLoader.db_url)
+        db[Loader.LIST_TABLE].insert_many(list_recs)
+        db[Loader.CODE_TABLE].insert_many(code_recs)
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+class LoaderQueryCacheTest(LoaderTestBase):
+    def test_repeated_query_is_cached(self):
+        loader = self.loader_class()
+        first = loader.get(text_expr='file_3')
+        second = loader.get(text_expr='file_3')
+        self.assertIs(first, second)
+        self.assertEqual(list(first.values())[0]['file_name'], 'file_3.py')
+
+    def test_invalidate_clears_cache(self):
+        loader = self.loader_class()
+        first = loader.get(text_expr='file_3')
+        loader.invalidate()
+        self.assertEqual(len(loader.query_cache), 0)
+        self.assertIsNot(first, loader.get(text_expr='file_3'))
+
+    def test_cache_is_bounded(self):
+        loader = self.loader_class()
+        loader.QUERY_CACHE_SIZE = 2
+        for expr in ['a', 'b', 'c']:
+            loader.get(text_expr=expr)
+        self.assertEqual(
+            list(loader.query_cache.keys()),
+            [(None, 'b', None, None, None), (None, 'c', None, None, None)]
+        )
+
+
+class RankingTest(TestCase):
+    def test_head_then_lazy_tail(self):
+        records = {f'g{ind}': ind for ind in range(6)}
+        scored = [(50, 'g0'), (90, 'g1'), (50, 'g2'), (10, 'g3'), (95, 'g4'), (50, 'g5')]
+        ranking = Ranking(records, scored, head_size=2)
+        self.assertEqual(ranking._keys, ['g4', 'g1'])
+        self.assertEqual(list(ranking), ['g4', 'g1', 'g0', 'g2', 'g5', 'g3'])
+        self.assertEqual(ranking['g3'], 3)
+        self.assertEqual(len(ranking), 6)
+
+    def test_matches_process_extract(self):
+        from fuzzywuzzy import process
+        choices = {ind: f'some text {ind % 7} with words {ind * 13}' for ind in range(200)}
+        scored = [(tup[1], tup[2]) for tup in process.extractWithoutOrder('text 3 words', choices)]
+        expected = [tup[2] for tup in process.extract('text 3 words', choices, limit=len(choices))]
+        self.assertEqual(list(Ranking(choices, scored, head_size=10)), expected)
+
+
+class RecordStoreTest(LoaderTestBase):
+    def setUp(self):
+        super().setUp()
+        list_recs, code_recs = make_records(1)
+        list_recs[0].update(file='another.py', file_url='https://gist.githubusercontent.com/user/0/raw/another.py')
+        code_recs[0].update(file_url=list_recs[0]['file_url'], code='print("another")')
+        updater = self.updater_class()
+        updater.list_table.insert(list_recs[0])
+        updater.code_table.insert(code_recs[0])
+
+    def test_every_file_of_a_gist_is_a_record(self):
+        loader = self.loader_class()
+        self.assertEqual(len(loader.records), self.num_records + 1)
+        first = loader.records[0]
+        self.assertEqual((first['gid'], first['file_name'], first['code']), ('gist0', 'another.py', 'print("another")'))
+
+        # Repeated strings are stored once
+        gids = loader.store.columns['gid']
+        self.assertIs(gids[0], gids[row_id(loader, 'file_0.py')])
+
+    def test_filters_pass_row_ids(self):
+        loader = self.loader_class()
+        recs = loader.get(glob_expr='file_[12].py', file_expr='file_2')
+        self.assertEqual(list(recs), [row_id(loader, 'file_2.py'), row_id(loader, 'file_1.py')])
+        self.assertEqual([r['file_name'] for r in recs.values()], ['file_2.py', 'file_1.py'])
+
+
+class ScorerTest(TestCase):
+    choices = {
+        'a': 'import pandas as pd\ndf = pd.read_csv(path)',
+        'b': 'docker run --rm -it ubuntu bash',
+        'c': 'def read_csv_file(path):\n    return open(path).read()',
+        'd': 'SELECT * FROM table WHERE x > 1',
+    }
+
+    def test_rapidfuzz_agrees_with_fuzzywuzzy(self):
+        try:
+            import rapidfuzz  # noqa
+        except ImportError:
+            self.skipTest('rapidfuzz not installed')
+
+        for query in ['pandas read_csv', 'docker bash', 'select from']:
+            expected = get_scorer('fuzzywuzzy').score(query, self.choices)
+            scores = get_scorer('rapidfuzz').score(query, self.choices)
+            # The implementations differ in partial alignment, so only the best match has to agree
+            self.assertEqual(set(scores), set(expected))
+            self.assertEqual(scores[max(expected, key=expected.get)], max(scores.values()))
+
+    def test_substring_scorer(self):
+        scorer = get_scorer('substring')
+        self.assertEqual(scorer.score('read_csv', self.choices), {'a': 100, 'c': 100})
+        self.assertEqual(scorer.score('pandas docker', self.choices), {'a': 50, 'b': 50})
+        self.assertEqual(scorer.score('x [>]', self.choices), {'d': 100})
+        self.assertEqual(scorer.score('(unclosed', self.choices), {})
+        self.assertEqual(scorer.score('pandas', dict(self.choices, e=None)), {'a': 100})
+
+    def test_cutoff(self):
+        scores = get_scorer('fuzzywuzzy', score_cutoff=60).score('docker bash', self.choices)
+        self.assertEqual(list(scores), ['b'])
+
+    def test_unknown_scorer(self):
+        with self.assertRaises(ValueError):
+            get_scorer('nope')
+
+
+class NullDescriptionTest(LoaderTestBase):
+    def test_substring_scorer_skips_null_descriptions(self):
+        updater = self.updater_class()
+        updater.list_table.update(dict(gist_id='gist3', description=None), ['gist_id'])
+        updater.set_scorer('substring')
+        updater.set_weighted_ranking(True)
+        loader = self.loader_class()
+        recs = loader.get(desc_expr='number 4')
+        self.assertEqual(list(recs.values())[0]['file_name'], 'file_4.py')
+        self.assertNotIn(row_id(loader, 'file_3.py'), recs)
+        self.assertEqual(list(loader.get(text_expr='hello 3').values())[0]['file_name'], 'file_3.py')
+
+
+class WeightedRankingTest(LoaderTestBase):
+    def setUp(self):
+        super().setUp()
+        self.updater_class().set_weighted_ranking(True)
+        self.updater_class().code_table.update(dict(file_url=self.file_url(4), code='file_9 is great'), ['file_url'])
+
+    def file_url(self, ind):
+        return make_records(self.num_records)[0][ind]['file_url']
+
+    def test_file_name_outweighs_code(self):
+        loader = self.loader_class()
+        self.assertTrue(loader.weighted)
+        names = [r['file_name'] for r in loader.get(text_expr='file_9').values()]
+        self.assertEqual(names[0], 'file_9.py')
+        self.assertLess(names.index('file_4.py'), names.index('file_3.py'))
+
+    def test_field_expression_only_scores_its_field(self):
+        loader = self.loader_class()
+        fields = []
+        field_values = loader.field_values
+        loader.field_values = lambda records, field: fields.append(field) or field_values(records, field)
+        recs = loader.get(code_expr='file_9')
+        self.assertEqual(fields, ['code'])
+        self.assertEqual(list(recs.values())[0]['file_name'], 'file_4.py')
+
+
+class ParallelScoringTest(LoaderTestBase):
+    num_records = 30
+
+    def test_pool_matches_serial_ranking(self):
+        serial = self.loader_class()
+        serial.PARALLEL_MIN_RECORDS = 10 ** 9
+        parallel = self.loader_class()
+        parallel.PARALLEL_MIN_RECORDS = 0
+        parallel.scoring_workers = 3
+        try:
+            self.assertIsNotNone(parallel.scoring_pool)
+            for kwargs in [dict(text_expr='hello 2'), dict(file_expr='file_1'), dict(code_expr='hello 17')]:
+                self.assertEqual(list(parallel.get(**kwargs)), list(serial.get(**kwargs)))
+
+            subset = RowSet(parallel.store, range(5, 12))
+            self.assertEqual(
+                parallel.score(subset, 'hello', 'text'),
+                serial.score(subset, 'hello', 'text'),
+            )
+        finally:
+            parallel.invalidate()
+
+
+class RefineTest(LoaderTestBase):
+    def test_growing_query_rescores_previous_matches(self):
+        loader = self.loader_class()
+        loader.REFINE_MIN_SCORE = 90
+        loader.get(file_expr='file_1')
+        scored = []
+        field_values = loader.field_values
+        loader.field_values = lambda records, field: scored.append(len(records)) or field_values(records, field)
+
+        recs = loader.get(file_expr='file_1.')
+        self.assertEqual(list(recs.values())[0]['file_name'], 'file_1.py')
+        self.assertEqual(len(scored), 1)
+        self.assertLess(scored[0], self.num_records)
+
+    def test_backspace_pops_to_cached_ranking(self):
+        loader = self.loader_class()
+        short = loader.get(text_expr='file')
+        loader.get(text_expr='file_2')
+        loader.query_cache.clear()
+        self.assertIs(loader.get(text_expr='file'), short)
+        self.assertEqual([e[0] for e in loader.refine_stacks[('text', (None,))]], ['file'])
+
+    def test_stacks_are_kept_for_recent_contexts_only(self):
+        loader = self.loader_class()
+        for ind in range(20):
+            loader.get(text_expr=f'hello {ind}', file_expr='file')
+        self.assertLessEqual(len(loader.refine_stacks), loader.REFINE_CONTEXTS)
+        self.assertIn(('file_name', (None, 'hello 19', None)), loader.refine_stacks)
+
+
+class TrigramTest(LoaderTestBase):
+    def test_trigrams_are_normalized(self):
+        self.assertEqual(trigrams('A-bcD'), {'a b', ' bc', 'bcd'})
+        self.assertEqual(trigrams('ab'), set())
+
+    def test_index_prunes_candidates(self):
+        self.updater_class().update_trigram_table()
+        loader = self.loader_class()
+        self.assertTrue(loader.has_trigrams)
+        recs = loader.get(text_expr='hello 7')
+        self.assertEqual(list(recs.values())[0]['file_name'], 'file_7.py')
+        self.assertEqual(len(loader.get(text_expr='qqqqqq')), 0)
+
+    def test_short_queries_are_not_pruned(self):
+        self.updater_class().update_trigram_table()
+        loader = self.loader_class()
+        self.assertEqual(len(loader.get(text_expr='qq')), self.num_records)
+
+    def test_old_index_is_rebuilt_and_kept_current(self):
+        updater = self.updater_class()
+        updater.db[Loader.TRIGRAM_TABLE].insert(dict(gram='hel', file_url='gone'))
+        self.assertFalse(self.loader_class().has_trigrams)
+
+        updater.update_trigram_table()
+        file_url = make_records(self.num_records)[0][7]['file_url']
+        updater.delete_from_indexes([file_url])
+        loader = self.loader_class()
+        self.assertTrue(loader.has_trigrams)
+        self.assertEqual(len(loader.candidate_file_urls('hello')), self.num_records - 1)
+
+    def test_fts_backend_skips_the_index(self):
+        updater = self.updater_class()
+        updater.update_trigram_table()
+        updater.iter_gists = lambda since=None: iter([])
+        updater.get_code = lambda url: 'code'
+        updater.settings = {'SEARCH_BACKEND': 'fts'}
+        updater.sync()
+        self.assertFalse(self.loader_class().has_trigrams)
+
+
+class FTSTest(LoaderTestBase):
+    def setUp(self):
+        super().setUp()
+        updater = self.updater_class()
+        updater.update_fts_table()
+        updater.set_search_backend('fts')
+
+    def test_backend_comes_from_settings(self):
+        self.assertEqual(self.loader_class().search_backend, 'fts')
+
+    def test_fts_query_translation(self):
+        loader = self.loader_class()
+        self.assertEqual(loader.fts_query('pan "read csv" x'), '"pan"* "read csv" "x"*')
+        self.assertEqual(loader.fts_query('"unclosed'), '"unclosed"*')
+
+    def test_prefix_and_field_search(self):
+        loader = self.loader_class()
+        recs = loader.get(text_expr='file_7')
+        self.assertEqual([r['file_name'] for r in recs.values()], ['file_7.py'])
+        recs = loader.get(desc_expr='numb 4')
+        self.assertEqual([r['file_name'] for r in recs.values()], ['file_4.py'])
+        self.assertEqual(len(loader.get(code_expr='description')), 0)
+
+    def test_update_removes_deleted_files(self):
+        updater = self.updater_class()
+        updater.list_table.delete(gist_id='gist7')
+        updater.update_fts_table()
+        self.assertEqual(len(self.loader_class().get(text_expr='file_7')), 0)
+
+    def test_sync_builds_the_index_only_for_fts(self):
+        updater = self.updater_class()
+        updater.iter_gists = lambda since=None: iter([])
+        updater.get_code = lambda url: 'code'
+        updater.sync()
+        self.assertTrue(self.loader_class().has_fts)
+
+        updater.settings = {'SEARCH_BACKEND': 'fuzzy'}
+        updater.sync()
+        self.assertFalse(self.loader_class().has_fts)
+
+
+class LazyCodeTest(LoaderTestBase):
+    def setUp(self):
+        super().setUp()
+        self.updater_class().set_lazy_code(True)
+
+    def test_records_have_no_code(self):
+        loader = self.loader_class()
+        self.assertTrue(loader.lazy)
+        rec = loader.records[row_id(loader, 'file_3.py')]
+        self.assertNotIn('code', rec)
+        self.assertEqual(loader.code(rec), 'print("hello 3")')
+        self.assertIn(rec['file_url'], loader.code_cache)
+
+    def test_code_search_loads_code(self):
+        loader = self.loader_class()
+        recs = loader.get(code_expr='hello 6')
+        self.assertEqual(list(recs.values())[0]['file_name'], 'file_6.py')
+
+    def test_code_cache_is_bounded(self):
+        loader = self.loader_class()
+        loader.CODE_CACHE_SIZE = 2
+        for rec in loader.records.values():
+            loader.code(rec)
+        self.assertEqual(len(loader.code_cache), 2)
+
+
+class ChunkedCodeTest(LoaderTestBase):
+    def setUp(self):
+        super().setUp()
+        updater = self.updater_class()
+        updater.set_chunked_code(True)
+        code = '\n'.join(f'x = {ind}' for ind in range(100)) + '\nimport pandas as pd'
+        file_url = make_records(self.num_records)[1][5]['file_url']
+        updater.code_table.update(dict(file_url=file_url, code=code), ['file_url'])
+
+    def test_line_windows(self):
+        self.assertEqual(line_windows('a\nb', 3), [(1, 2, 'a\nb')])
+        self.assertEqual(line_windows('', 3), [(1, 1, '')])
+        text = '\n'.join('abcdefg')
+        self.assertEqual([w[:2] for w in line_windows(text, 3, 1)], [(1, 3), (3, 5), (5, 7)])
+
+    def test_best_window_lines_are_exposed(self):
+        loader = self.loader_class()
+        self.assertTrue(loader.chunked)
+        recs = loader.get(code_expr='import pandas')
+        self.assertEqual(list(recs.values())[0]['file_name'], 'file_5.py')
+        self.assertEqual(recs.lines[row_id(loader, 'file_5.py')], (91, 101))
+
+        # Lines survive a ranking chained on top
+        recs = loader.get(code_expr='import pandas', file_expr='file_5')
+        self.assertEqual(recs.lines[row_id(loader, 'file_5.py')], (91, 101))
+
+    def test_window_text_is_built_once(self):
+        loader = self.loader_class()
+        first = list(loader.get(text_expr='import pandas'))
+        self.assertEqual(len(loader.text_windows[row_id(loader, 'file_5.py')]), 4)
+
+        loader.make_text = mock.Mock(side_effect=AssertionError('text rebuilt'))
+        self.assertEqual(list(loader.get(text_expr='pandas import')), first)
+
+    def test_code_pane_jumps_to_match(self):
+        from gistfinder.ui import AppState
+        from prompt_toolkit.filters import to_filter
+        state = AppState(self.loader_class())
+        state.search_buffer.read_only = to_filter(False)
+        state.search_buffer.text = r'\cimport pandas'
+        self.assertEqual(state.list_lines[0], 'file_5.py')
+        self.assertEqual(state.content_buffer.document.cursor_position_row, 90)
+
+
+class SearchCacheTest(LoaderTestBase):
+    def setUp(self):
+        super().setUp()
+        updater = self.updater_class()
+        version = updater.corpus_version()
+        updater.set_meta('corpus_version', version)
+        updater.update_search_table(version)
+
+    def no_search(self, loader):
+        def fail(*key):
+            raise AssertionError(f'searched for {key}')
+        loader._get = fail
+
+    def test_records_come_from_search_table(self):
+        loader = self.loader_class()
+        self.assertTrue(loader.has_search_table)
+        rec = loader.records[row_id(loader, 'file_3.py')]
+        self.assertEqual(rec['text'], 'file_3.py description number 3 print("hello 3")')
+        self.assertEqual(rec['code'], 'print("hello 3")')
+
+        self.updater_class().set_meta('corpus_version', 'other')
+        loader = self.loader_class()
+        self.assertFalse(loader.has_search_table)
+        rec = loader.records[row_id(loader, 'file_3.py')]
+        self.assertEqual(rec['text'], 'file_3.py description number 3 print("hello 3")')
+
+    def test_rankings_persist_across_sessions(self):
+        loader = self.loader_class()
+        expected = list(loader.get(text_expr='file_3'))
+        loader.get(glob_expr='*.py')
+        loader.save_query_cache()
+
+        loader = self.loader_class()
+        self.no_search(loader)
+        self.assertEqual(list(loader.get(text_expr='file_3')), expected)
+
+    def test_new_corpus_version_drops_saved_rankings(self):
+        loader = self.loader_class()
+        loader.get(text_expr='file_3')
+        loader.save_query_cache()
+
+        self.updater_class().set_meta('corpus_version', 'other')
+        loader = self.loader_class()
+        self.assertIsNone(loader.load_saved_query((None, 'file_3', None, None, None)))
+
+    def test_redownloaded_code_changes_the_version(self):
+        updater = self.updater_class()
+        version = updater.corpus_version()
+        file_url = updater.code_table.find_one()['file_url']
+        updater.code_table.update(dict(file_url=file_url, updated_at='2021-01-01T00:00:00Z'), ['file_url'])
+        self.assertNotEqual(updater.corpus_version(), version)
+
+    def test_old_schema_is_rebuilt(self):
+        updater = self.updater_class()
+        updater.set_meta('search_schema', '1')
+        self.assertFalse(self.loader_class().has_search_table)
+
+        updater.update_search_table(updater.corpus_version())
+        loader = self.loader_class()
+        self.assertTrue(loader.has_search_table)
+        self.assertEqual(loader.records[0]['language'], 'Python')
+
+    def test_rankings_are_not_saved_into_a_swapped_database(self):
+        loader = self.loader_class()
+        loader.get(text_expr='file_3')
+        shutil.copy(loader.db_file, loader.db_file + '.copy')
+        os.replace(loader.db_file + '.copy', loader.db_file)
+        loader.save_query_cache()
+        self.assertEqual(len(self.loader_class().saved_queries), 0)
+
+    def test_rankings_are_not_saved_during_a_sync(self):
+        loader = self.loader_class()
+        loader.get(text_expr='file_3')
+        with self.updater_class().sync_lock():
+            loader.save_query_cache()
+        self.assertEqual(len(self.loader_class().saved_queries), 0)
+        loader.save_query_cache()
+        self.assertEqual(len(self.loader_class().saved_queries), 1)
+
+    def test_saved_rankings_are_bounded(self):
+        loader = self.loader_class()
+        loader.QUERY_PERSIST_SIZE = 2
+        for expr in ['a', 'b', 'c']:
+            loader.get(text_expr=expr)
+        loader.save_query_cache()
+        self.assertEqual(
+            list(self.loader_class().saved_queries),
+            [(None, 'b', None, None, None), (None, 'c', None, None, None)]
+        )
+
+
+class UpdateCodeTableTest(LoaderTestBase):
+    def test_missing_code_is_downloaded(self):
+        updater = self.updater_class()
+        missing = [updater.list_table.find_one(gist_id=f'gist{ind}')['file_url'] for ind in range(5)]
+        updater.code_table.delete(file_url={'in': missing})
+        updater.get_code = lambda url: None if url.endswith('file_0.py') else f'code for {url}'
+        updater.INSERT_BATCH_SIZE = 2
+        updater.update_code_table(verbose=False)
+
+        codes = {r['file_url']: r['code'] for r in updater.code_table.all()}
+        self.assertEqual(len(codes), self.num_records - 1)
+        url = updater.list_table.find_one(gist_id='gist3')['file_url']
+        self.assertEqual(codes[url], f'code for {url}')
+
+
+def make_gist(gist_id, updated_at, *file_names):
+    return {
+        'url': f'https://api.github.com/gists/{gist_id}',
+        'id': gist_id,
+        'description': f'gist {gist_id}',
+        'created_at': '2020-01-01T00:00:00Z',
+        'updated_at': updated_at,
+        'files': {
+            name: {'filename': name, 'language': 'Python', 'raw_url': f'https://raw/{gist_id}/{name}', 'size': 1}
+            for name in file_names
+        }
+    }
+
+
+class IncrementalSyncTest(LoaderTestBase):
+    num_records = 0
+
+    def sync(self, gists):
+        updater = self.updater_class()
+        updater.iter_gists = lambda since=None: self.calls.append(since) or iter(gists)
+        updater.get_code = lambda url: f'{url} at {self.version}'
+        updater.update_list_table()
+        updater.update_code_table(verbose=False)
+        return updater
+
+    def test_only_edited_gists_are_refreshed(self):
+        self.calls = []
+        self.version = 1
+        self.sync([
+            make_gist('a', '2020-01-01T00:00:00Z', 'a1.py', 'a2.py'),
+            make_gist('b', '2020-01-02T00:00:00Z', 'b.py'),
+        ])
+        self.version = 2
+        updater = self.sync([make_gist('a', '2020-02-01T00:00:00Z', 'a1.py')])
+
+        self.assertEqual(self.calls, [None, '2020-01-02T00:00:00Z'])
+        self.assertEqual(updater.get_meta('since'), '2020-02-01T00:00:00Z')
+        self.assertEqual(sorted(r['file'] for r in updater.list_table.all()), ['a1.py', 'b.py'])
+        self.assertEqual(updater.code_table.count(), 2)
+        codes = {r['file_url']: r['code'] for r in updater.code_table.all()}
+        self.assertEqual(codes, {
+            'https://raw/a/a1.py': 'https://raw/a/a1.py at 2',
+            'https://raw/b/b.py': 'https://raw/b/b.py at 1',
+        })
+
+    def test_full_sync_removes_deleted_gists(self):
+        self.calls = []
+        self.version = 1
+        self.sync([make_gist('a', '2020-01-01T00:00:00Z', 'a.py'), make_gist('b', '2020-01-01T00:00:00Z', 'b.py')])
+        updater = self.updater_class()
+        updater.iter_gists = lambda since=None: iter([make_gist('b', '2020-01-01T00:00:00Z', 'b.py', 'b.ipynb')])
+        updater.INSERT_BATCH_SIZE = 1
+        updater.update_list_table(full=True)
+        self.assertEqual([r['file'] for r in updater.list_table.all()], ['b.py'])
+
+
+class StagedSyncTest(LoaderTestBase):
+    def updater(self, *gists):
+        updater = self.updater_class()
+        updater.iter_gists = lambda since=None: iter(gists)
+        updater.get_code = lambda url: f'code of {url}'
+        return updater
+
+    def test_sync_swaps_in_a_complete_database(self):
+        loader = self.loader_class()
+        self.assertEqual(len(loader.records), self.num_records)
+        inode = os.stat(loader.db_file).st_ino
+
+        updater = self.updater(make_gist('a', '2021-01-01T00:00:00Z', 'a.py'))
+        self.assertTrue(updater.sync())
+        self.assertNotEqual(os.stat(loader.db_file).st_ino, inode)
+        self.assertFalse(os.path.exists(updater.staging_file))
+
+        loader = self.loader_class()
+        self.assertEqual(len(loader.records), self.num_records + 1)
+        self.assertTrue(loader.has_search_table)
+        self.assertEqual(next(iter(loader.db.query('pragma journal_mode')))['journal_mode'], 'delete')
+
+    def test_failed_sync_leaves_database_alone(self):
+        inode = os.stat(self.loader_class.db_file).st_ino
+        updater = self.updater()
+        updater.update_code_table = mock.Mock(side_effect=RuntimeError('offline'))
+        with self.assertRaises(RuntimeError):
+            updater.sync()
+        self.assertEqual(os.stat(self.loader_class.db_file).st_ino, inode)
+        self.assertEqual(len(self.loader_class().records), self.num_records)
+
+    def test_reset_starts_from_an_empty_database(self):
+        self.updater(make_gist('a', '2021-01-01T00:00:00Z', 'a.py')).reset()
+        loader = self.loader_class()
+        self.assertEqual([row['file_name'] for row in loader.records.values()], ['a.py'])
+
+    def test_only_one_sync_runs_at_a_time(self):
+        with self.updater_class().sync_lock():
+            self.assertFalse(self.updater().sync(wait=False))
+
+    def test_sync_runs_without_file_locks(self):
+        with mock.patch('gistfinder.config.fcntl', None), mock.patch('gistfinder.config.msvcrt', None):
+            with self.updater_class().sync_lock() as locked:
+                self.assertTrue(locked)
+                self.assertTrue(self.updater().sync(wait=False))
+
+    def test_watch_keeps_syncing_after_failures(self):
+        updater = self.updater()
+        updater.sync = mock.Mock(side_effect=[requests.ConnectionError('offline'), True])
+        with mock.patch('gistfinder.sync.time.sleep', side_effect=[None, KeyboardInterrupt]) as sleep:
+            with self.assertRaises(KeyboardInterrupt):
+                updater.watch(interval=5)
+        self.assertEqual(updater.sync.call_count, 2)
+        sleep.assert_called_with(5)
+
+    def test_watch_survives_rate_limit_errors(self):
+        updater = self.updater_class()
+        updater.user_url = 'https://api.github.com/users/me/gists'
+        updater.github_token = 'token'
+        updater.session = FakeSession(FakeResponse(403, {'message': 'API rate limit exceeded'}))
+        stderr = io.StringIO()
+        with mock.patch('gistfinder.sync.time.sleep', side_effect=KeyboardInterrupt), redirect_stderr(stderr):
+            with self.assertRaises(KeyboardInterrupt):
+                updater.watch(interval=5)
+        self.assertIn('Sync failed: HTTPError: 403', stderr.getvalue())
+        self.assertEqual(len(self.loader_class().records), self.num_records)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Client Error')
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def get(self, url, params=None, headers=None):
+        self.sent_headers.append(headers)
+        return self.responses.pop(0)
+
+
+class ConditionalRequestTest(LoaderTestBase):
+    def test_not_modified_page_comes_from_cache(self):
+        page = [make_gist('a', '2020-01-01T00:00:00Z', 'a.py')]
+        updater = self.updater_class()
+        updater.user_url = 'https://api.github.com/users/me/gists'
+        updater.github_token = 'token'
+        updater.session = FakeSession(
+            FakeResponse(200, page, {'ETag': '"abc"'}),
+            FakeResponse(304),
+        )
+
+        self.assertEqual(updater.get_page({'page': 1}), (page, None))
+        self.assertEqual(updater.get_page({'page': 1}), (page, None))
+        self.assertNotIn('If-None-Match', updater.session.sent_headers[0])
+        self.assertEqual(updater.session.sent_headers[1]['If-None-Match'], '"abc"')
+
+    def test_listing_prunes_pages_it_did_not_request(self):
+        updater = self.updater_class()
+        updater.user_url = 'https://api.github.com/users/me/gists'
+        updater.github_token = 'token'
+        updater.session = FakeSession(FakeResponse(200, []), FakeResponse(200, []))
+        updater.get_page({'page': 1, 'since': '2020-01-01T00:00:00Z'})
+        updater.update_list_table()
+        urls = [r['url'] for r in updater.page_table.all()]
+        self.assertEqual(len(urls), 1)
+        self.assertNotIn('since=2020-01-01', urls[0])
+
+    def test_listing_requests_are_rate_limited(self):
+        headers = {'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': str(time.time() + 100)}
+        updater = self.updater_class()
+        updater.user_url = 'https://api.github.com/users/me/gists'
+        updater.github_token = 'token'
+        updater.session = FakeSession(FakeResponse(200, [], headers))
+        updater.rate_limiter = RateLimiter(rate=100)
+        updater.rate_limiter.acquire = mock.Mock(wraps=updater.rate_limiter.acquire)
+        updater.get_page({'page': 1})
+        updater.rate_limiter.acquire.assert_called_once()
+        self.assertAlmostEqual(updater.rate_limiter.rate, .1, places=2)
+
+    def test_downloads_keep_their_own_rate(self):
+        updater = self.updater_class()
+        updater.rate_limiter.update({'X-RateLimit-Remaining': '4999', 'X-RateLimit-Reset': str(time.time() + 3600)})
+        updater.session = FakeSession(FakeResponse(200, 'code'))
+        updater.get_code('https://gist.githubusercontent.com/me/1/raw/a.py')
+        self.assertLess(updater.rate_limiter.rate, 2)
+        self.assertEqual(updater.download_limiter.rate, updater.REQUESTS_PER_SECOND)
+
+
+class PaginationTest(LoaderTestBase):
+    def test_pages_follow_link_header(self):
+        link = (
+            '<https://api.github.com/user/1/gists?per_page=100&page=2>; rel="next", '
+            '<https://api.github.com/user/1/gists?per_page=100&page=3>; rel="last"'
+        )
+        updater = self.updater_class()
+        requested = []
+
+        def get_page(params):
+            requested.append(params['page'])
+            return [params['page']], link
+
+        updater.get_page = get_page
+        self.assertEqual(list(updater.blob_generator()), [[1], [2], [3]])
+        self.assertEqual(sorted(requested), [1, 2, 3])
+        self.assertEqual(updater.get_last_page(None), 1)
+
+    def test_pages_in_flight_are_bounded(self):
+        link = '<https://api.github.com/user/1/gists?per_page=100&page=50>; rel="last"'
+        updater = self.updater_class()
+        updater.download_workers = 2
+        requested = []
+
+        def get_page(params):
+            requested.append(params['page'])
+            return [params['page']], link
+
+        updater.get_page = get_page
+        pages = updater.blob_generator()
+        self.assertEqual([next(pages), next(pages)], [[1], [2]])
+        self.assertLessEqual(len(requested), 4)
+        self.assertEqual(list(pages), [[page] for page in range(3, 51)])
+
+    def test_downloads_in_flight_are_bounded(self):
+        updater = self.updater_class()
+        updater.download_workers = 2
+        requested = []
+        updater.get_code = lambda url: requested.append(url) or f'code of {url}'
+        downloads = updater.download_codes(f'url{ind}' for ind in range(50))
+        next(downloads)
+        self.assertLessEqual(len(requested), 4)
+        self.assertEqual(len(list(downloads)), 49)
+
+
+class RateLimiterTest(TestCase):
+    def test_bucket_paces_requests(self):
+        limiter = RateLimiter(rate=100, capacity=1)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, .04)
+
+    def test_headers_lower_the_rate(self):
+        limiter = RateLimiter(rate=100)
+        limiter.update({'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': str(time.time() + 100)})
+        self.assertAlmostEqual(limiter.rate, .1, places=2)
+        limiter.update({})
+        self.assertAlmostEqual(limiter.rate, .1, places=2)
+
+
+class BackgroundSearchTest(LoaderTestBase):
+    def make_state(self):
+        from gistfinder.ui import AppState
+        from prompt_toolkit.filters import to_filter
+        state = AppState(self.loader_class())
+        state.search_buffer.read_only = to_filter(False)
+        return state
+
+    def test_search_without_event_loop_is_synchronous(self):
+        state = self.make_state()
+        state.search_buffer.text = 'file_4'
+        self.assertEqual(state.list_lines[0], 'file_4.py')
+        self.assertEqual(state.content_buffer.text, 'print("hello 4")')
+
+    def test_newest_query_wins(self):
+        state = self.make_state()
+        searched = []
+        fetch_rows = state.fetch_rows
+        state.fetch_rows = lambda key: searched.append(key) or fetch_rows(key)
+
+        async def type_query():
+            for text in ['f', 'fi', 'file_8']:
+                state.search_buffer.text = text
+            await state._search_task
+
+        asyncio.run(type_query())
+        self.assertEqual(searched, [(None, 'file_8', None, None, None)])
+        self.assertEqual(state.list_lines[0], 'file_8.py')
+
+    def test_search_prefixes(self):
+        state = self.make_state()
+        state.search_buffer.text = r'hello \g*.py\f file_5 \c'
+        self.assertEqual(state.query_key, ('*.py', 'hello', None, 'file_5', None))
+        state.search_buffer.text = r'\dnumber 2\t3'
+        self.assertEqual(state.query_key, (None, '3', 'number 2', None, None))
+        state.search_buffer.text = '\\'
+        self.assertEqual(state.query_key, (None, None, None, None, None))
+
+    def test_rows_load_as_the_list_scrolls(self):
+        state = self.make_state()
+        state.loader.TOP_K = 4
+        state.search_buffer.text = 'file'
+        self.assertEqual(len(state.list_lines), 4)
+        self.assertEqual(state.row_count, self.num_records)
+
+        # Drawing rows 5 and 6 pulls just the next page from the ranking
+        content = state.list_control.create_content(width=20, height=2)
+        self.assertEqual(content.line_count, self.num_records)
+        self.assertEqual([content.get_line(ind)[0][1] for ind in [5, 6]], [state.list_lines[5], state.list_lines[6]])
+        self.assertEqual(len(state.list_lines), 8)
+
+    def test_selection_is_clamped(self):
+        state = self.make_state()
+        state.select(4)
+        self.assertEqual(state.content_buffer.text, f'print("hello {state.selected_file_name[5]}")')
+        state.select(self.num_records + 5)
+        self.assertEqual(state.selected_index, self.num_records - 1)
+        state.select(-3)
+        self.assertEqual(state.selected_index, 0)
+
+
+class HighlightTest(TestCase):
+    def test_lexer_from_language_or_file_name(self):
+        from gistfinder.highlight import lexer_class
+        from pygments.lexers import BashLexer, CppLexer, PythonLexer, TextLexer
+        self.assertIs(lexer_class('Python', 'a.txt'), PythonLexer)
+        self.assertIs(lexer_class('C++', 'a.txt'), CppLexer)
+        self.assertIs(lexer_class('Not A Language', 'a.sh'), BashLexer)
+        self.assertIs(lexer_class(None, 'a.unknown'), TextLexer)
+
+    def test_lexed_lines_are_cached_per_file(self):
+        from gistfinder.highlight import CodeLexer
+        from prompt_toolkit.document import Document
+        lexer = CodeLexer()
+        lexer.set_file(dict(file_url='u1', language='Python', file_name='a.py'))
+        get_line = lexer.lex_document(Document('def f():\n    pass'))
+        self.assertIn(('class:pygments.keyword', 'def'), get_line(0))
+        self.assertIs(lexer.lex_document(Document('def f():\n    pass')), get_line)
+
+        lexer.set_file(dict(file_url='u2', language='Python', file_name='b.py'))
+        self.assertIsNot(lexer.lex_document(Document('def f():\n    pass')), get_line)
+
+    def test_large_files_are_plain_text(self):
+        from gistfinder.highlight import CodeLexer
+        from prompt_toolkit.document import Document
+        lexer = CodeLexer()
+        lexer.MAX_CHARS = 10
+        lexer.set_file(dict(file_url='u1', language='Python', file_name='a.py'))
+        get_line = lexer.lex_document(Document('def f():\n    pass'))
+        self.assertEqual(get_line(0), [('', 'def f():')])
+
+
+class SearchCommandTest(LoaderTestBase):
+    def run_cli(self, *args):
+        from click.testing import CliRunner
+        from gistfinder import console
+        with mock.patch.object(console, 'Loader', self.loader_class):
+            return CliRunner().invoke(console.cli, list(args))
+
+    def test_json_lines(self):
+        result = self.run_cli('search', 'file_3', '-n', '2', '--fields', 'file_name,score', '--format', 'json')
+        self.assertEqual(result.exit_code, 0)
+        rows = [json.loads(line) for line in result.output.splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0], {'file_name': 'file_3.py', 'score': 90})
+
+    def test_tsv_escapes_code(self):
+        self.updater_class().code_table.update(
+            dict(file_url=make_records(self.num_records)[1][2]['file_url'], code='a\tb\nc'), ['file_url']
+        )
+        result = self.run_cli('search', '--file', 'file_2', '-n', '1', '--fields', 'gid,code')
+        self.assertEqual(result.output, 'gist2\ta\\tb\\nc\n')
+
+    def test_filters_and_limit(self):
+        result = self.run_cli('search', '--glob', 'file_[1-3].py', '-n', '0', '--fields', 'file_name')
+        self.assertEqual(sorted(result.output.split()), ['file_1.py', 'file_2.py', 'file_3.py'])
+
+    def test_negative_limit_is_rejected(self):
+        result = self.run_cli('search', 'x', '--limit', '-1')
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('--limit', result.output)
+
+    def test_sync_flags_need_sync(self):
+        for args in [['--watch'], ['--full'], ['-w', '4'], ['--reset', '--watch']]:
+            result = self.run_cli(*args)
+            self.assertEqual(result.exit_code, 2, args)
+            self.assertIn('only applies with --sync', result.output)
+
+    def test_unknown_field_is_rejected(self):
+        result = self.run_cli('search', 'x', '--fields', 'file_name,bogus')
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('choose from', result.output)
+
+
+class ServerTest(LoaderTestBase):
+    def setUp(self):
+        super().setUp()
+        self.updater_class().set_meta('corpus_version', 'v1')
+        self.server = SearchServer(self.loader_class)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.remote = RemoteLoader.connect(self.loader_class.socket_file)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def wait_for_reload(self):
+        list(self.remote.request({'op': 'ping'}))
+        self.server.reloading.result()
+
+    def test_search_matches_local_results(self):
+        loader = self.loader_class()
+        fields = ['file_name', 'score', 'lines']
+        expected = list(loader.result_rows(loader.get(text_expr='file_3'), fields, 3))
+        self.assertEqual(list(self.remote.search_rows({'text_expr': 'file_3'}, fields, 3)), expected)
+
+    def test_results_are_paged(self):
+        self.remote.TOP_K = 3
+        result = self.remote.get(glob_expr='*.py')
+        self.assertEqual(len(result), self.num_records)
+        self.assertEqual(len(list(result.values())), self.num_records)
+        ind = row_id(self.server.loader, 'file_4.py')
+        self.assertEqual(result[ind]['file_name'], 'file_4.py')
+        self.assertEqual(self.remote.code(result[ind]), 'print("hello 4")')
+
+    def test_bad_request_is_reported(self):
+        with self.assertRaises(ServerError):
+            list(self.remote.request({'op': 'bogus'}))
+        self.assertIsNone(RemoteLoader.connect(os.path.join(self.temp_dir, 'missing.sock')))
+
+    def test_reloads_when_corpus_changes(self):
+        file_url = make_records(self.num_records)[1][3]['file_url']
+        updater = self.updater_class()
+        updater.code_table.update(dict(file_url=file_url, code='zebra'), ['file_url'])
+        updater.set_meta('corpus_version', 'v2')
+        self.wait_for_reload()
+        rows = self.remote.search_rows({'code_expr': 'zebra'}, ['file_name'], 1)
+        self.assertEqual(list(rows), [{'file_name': 'file_3.py'}])
+
+    def test_same_corpus_keeps_loader(self):
+        loader = self.server.loader
+        os.utime(self.loader_class.db_file, ns=(0, 0))
+        self.wait_for_reload()
+        list(self.remote.request({'op': 'ping'}))
+        self.assertIs(self.server.loader, loader)
+
+    def test_tui_loads_locally_without_unix_sockets(self):
+        from gistfinder import ui
+        with mock.patch.object(ui, 'socket', object()), mock.patch.object(ui, 'Loader', self.loader_class), \
+                mock.patch.dict(sys.modules, {'gistfinder.server': None}):
+            self.assertIsInstance(ui.UI().state.loader, self.loader_class)
+        with mock.patch.object(ui, 'Loader', self.loader_class):
+            self.assertIsInstance(ui.UI().state.loader, RemoteLoader)
+
+    def test_search_command_uses_server(self):
+        from click.testing import CliRunner
+        from gistfinder import console
+        self.server.loader.get = mock.Mock(wraps=self.server.loader.get)
+        with mock.patch.object(console, 'Loader', self.loader_class):
+            result = CliRunner().invoke(console.cli, ['search', 'file_3', '-n', '1', '--fields', 'file_name'])
+        self.assertEqual(result.output, 'file_3.py\n')
+        self.server.loader.get.assert_called_once()
+
+
+class StartupTest(TestCase):
+    def test_cli_import_is_light(self):
+        code = 'import sys, gistfinder.console; print(" ".join(sys.modules))'
+        loaded = set(subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).split())
+        for module in ['dataset', 'sqlalchemy', 'fuzzywuzzy', 'prompt_toolkit', 'pygments', 'requests', 'tqdm']:
+            self.assertNotIn(module, loaded)
 
 
 class SampleTest(TestCase):
@@ -0,0 +1,516 @@
+import asyncio
+import itertools
+import re
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_toolkit import Application
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.enums import EditingMode
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.layout.containers import VSplit, Window, HSplit
+from prompt_toolkit.layout.controls import BufferControl, UIContent, UIControl
+from prompt_toolkit.data_structures import Point
+from prompt_toolkit.mouse_events import MouseEventType
+
+
+from prompt_toolkit.layout.layout import Layout
+from prompt_toolkit.filters import to_filter, Condition
+from prompt_toolkit.styles import Style
+
+from prompt_toolkit.layout import NumberedMargin
+
+from .highlight import CodeLexer
+from .loader import Loader
+#  from .utils import print_temp
+
+from prompt_toolkit.application.current import get_app
+
+
+@Condition
+def not_in_search_mode():
+    app = get_app()
+    return app.state.layout.current_window != app.state.search_window
+
+
+class ResultListControl(UIControl):
+    """
+    Shows the file names of the current results.  Only the rows in view are asked
+    for, so drawing costs the same for ten results as for fifty thousand, and rows
+    are pulled from the ranking as the list scrolls to them.
+    """
+    def __init__(self, app_state):
+        self.app_state = app_state
+
+    def is_focusable(self):
+        return True
+
+    def create_content(self, width, height):
+        state = self.app_state
+
+        def get_line(index):
+            row = state.row(index)
+            return [('', row['file_name'] if row else '')]
+
+        return UIContent(
+            get_line=get_line,
+            line_count=state.row_count,
+            cursor_position=Point(x=0, y=state.selected_index),
+            show_cursor=False,
+        )
+
+    def mouse_handler(self, mouse_event):
+        if mouse_event.event_type == MouseEventType.MOUSE_UP:
+            self.app_state.select(mouse_event.position.y)
+            return None
+        return NotImplemented
+
+    def move_cursor_down(self):
+        self.app_state.select(self.app_state.selected_index + 1)
+
+    def move_cursor_up(self):
+        self.app_state.select(self.app_state.selected_index - 1)
+
+    def get_key_bindings(self):
+        kb = KeyBindings()
+        state = self.app_state
+
+        def page_size(event):
+            info = event.app.layout.current_window.render_info
+            return info.window_height if info else 10
+
+        @kb.add('j')
+        @kb.add('down')
+        def _(event):
+            state.select(state.selected_index + event.arg)
+
+        @kb.add('k')
+        @kb.add('up')
+        def _(event):
+            state.select(state.selected_index - event.arg)
+
+        @kb.add('g', eager=True)
+        @kb.add('home')
+        def _(event):
+            state.select(0)
+
+        @kb.add('G')
+        @kb.add('end')
+        def _(event):
+            state.select(state.row_count - 1)
+
+        @kb.add('pagedown')
+        @kb.add('c-f')
+        def _(event):
+            state.select(state.selected_index + page_size(event))
+
+        @kb.add('pageup')
+        @kb.add('c-b')
+        def _(event):
+            state.select(state.selected_index - page_size(event))
+
+        return kb
+
+
+class AppState:
+    SEARCH_DEFAULT_TEXT = r' Search:/  Window:<space> Select:<enter> Exit:<ctrl-c> '
+    QUERY_FIELDS = ('glob_expr', 'text_expr', 'desc_expr', 'file_expr', 'code_expr')
+
+    # Seconds to wait for more keystrokes before searching
+    SEARCH_DEBOUNCE = .1
+
+    def __init__(self, loader):
+        self.glob_expr = None
+        self.text_expr = None
+        self.desc_expr = None
+        self.file_expr = None
+        self.code_expr = None
+
+        self.loader = loader
+        self._rows_key = self.query_key
+        self._result, self._rows, self._more_rows = self.fetch_rows(self._rows_key)
+
+        # Searches run one at a time off the event loop, newest query wins
+        self.search_executor = ThreadPoolExecutor(max_workers=1)
+        self._search_task = None
+
+        # Ship records to the scoring processes (if the corpus is big enough) before the first search
+        self.search_executor.submit(lambda: self.loader.scoring_pool)
+
+        self.list_control = ResultListControl(self)
+
+        self.code_lexer = CodeLexer()
+        self.content_buffer = Buffer()  # Editable buffer.
+        self.content_buffer.app_state = self
+        self.set_code(0)
+
+        self.search_buffer = Buffer(on_text_changed=self.search_text_change)
+        self.search_buffer.app_state = self
+        self.search_buffer.read_only = to_filter(True)
+
+        self.description_buffer = Buffer()
+        self.description_buffer.app_state = self
+        self.description_buffer.read_only = to_filter(True)
+
+        self.slash_buffer = Buffer()
+        self.slash_buffer.app_state = self
+        self.slash_buffer.read_only = to_filter(True)
+
+        self._index = 0
+        self.print_on_exit = False
+
+    def clear_searches(self):
+        self.glob_expr = None
+        self.text_expr = None
+        self.desc_expr = None
+        self.file_expr = None
+        self.code_expr = None
+
+    @property
+    def query_key(self):
+        return (self.glob_expr, self.text_expr, self.desc_expr, self.file_expr, self.code_expr)
+
+    def fetch_rows(self, key):
+        """
+        Returns the results of a query, their first page of rows and an iterator over
+        the rest.
+        """
+        records = self.loader.get(**dict(zip(self.QUERY_FIELDS, key)))
+        more_rows = iter(records.values())
+        return records, list(itertools.islice(more_rows, self.loader.TOP_K)), more_rows
+
+    @property
+    def list_rows(self):
+        # Ordered rows for the last finished query, so cursor moves are plain index lookups
+        return self._rows
+
+    @property
+    def row_count(self):
+        return len(self._result)
+
+    @property
+    def selected_index(self):
+        return self._index
+
+    def row(self, index):
+        """
+        Returns the row at index, pulling rows from the ranking until it is loaded.
+        """
+        while index >= len(self._rows):
+            rows = list(itertools.islice(self._more_rows, max(self.loader.TOP_K, index + 1 - len(self._rows))))
+            if not rows:
+                return None
+            self._rows.extend(rows)
+        return self._rows[index]
+
+    def select(self, index):
+        index = max(0, min(index, self.row_count - 1))
+        self.set_code(index)
+        self.set_description(index)
+
+    def apply_rows(self, key, result):
+        self._rows_key = key
+        self._result, self._rows, self._more_rows = result
+        self.set_code(0)
+        self.set_description(0)
+
+    def schedule_search(self):
+        """
+        Runs the current query in the background after a short debounce, cancelling
+        any search that hasn't finished yet.  Without a running event loop (i.e.
+        outside the app) the search runs right away.
+        """
+        if self._search_task:
+            self._search_task.cancel()
+
+        key = self.query_key
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.apply_rows(key, self.fetch_rows(key))
+            return
+        self._search_task = loop.create_task(self.search(key))
+
+    async def search(self, key):
+        await asyncio.sleep(self.SEARCH_DEBOUNCE)
+        result = await asyncio.get_running_loop().run_in_executor(self.search_executor, self.fetch_rows, key)
+        if key == self.query_key:
+            self.apply_rows(key, result)
+            get_app().invalidate()
+
+    @property
+    def list_lines(self):
+        return [r['file_name'] for r in self.list_rows]
+
+    @property
+    def descriptions(self):
+        return [r['description'] for r in self.loader.records.values()]
+
+    def search_text_change(self, buffer):
+        # Text before any prefix searches everything, \t does the same explicitly and
+        # \g, \d, \f and \c target the glob, description, file name and code
+        rex_glob = re.compile(r'\\g([^\\]+)')
+        rex_desc = re.compile(r'\\d([^\\]+)')
+        rex_file = re.compile(r'\\f([^\\]+)')
+        rex_code = re.compile(r'\\c([^\\]+)')
+        rex_text = re.compile(r'\\t([^\\]+)')
+        rex_bare = re.compile(r'^([^\\]+)')
+
+        def get_expr(*matches):
+            for m in matches:
+                if m and m.group(1).strip():
+                    return m.group(1).strip()
+            return None
+
+        app_state = buffer.app_state
+
+        query = buffer.text
+        self.clear_searches()
+
+        self.glob_expr = get_expr(rex_glob.search(query))
+        self.desc_expr = get_expr(rex_desc.search(query))
+        self.file_expr = get_expr(rex_file.search(query))
+        self.code_expr = get_expr(rex_code.search(query))
+        self.text_expr = get_expr(rex_text.search(query), rex_bare.search(query))
+
+        app_state.schedule_search()
+        return
+
+    def code(self, index):
+        self._index = index
+        row = self.row(index)
+        return self.loader.code(row) if row else ''
+
+    def description(self, index):
+        self._index = index
+        row = self.row(index)
+        return row['description'] if row else ''
+
+    def match_lines(self, index):
+        row = self.row(index)
+        return getattr(self._result, 'lines', {}).get(row.id) if row else None
+
+    def set_code(self, index):
+        content_buffer = self.content_buffer
+        self.code_lexer.set_file(self.row(index))
+        content_buffer.read_only = to_filter(False)
+        content_buffer.text = self.code(index)
+        content_buffer.read_only = to_filter(True)
+
+        # Put the cursor on the match so the code window scrolls to it
+        lines = self.match_lines(index)
+        if lines:
+            content_buffer.cursor_position = content_buffer.document.translate_row_col_to_index(lines[0] - 1, 0)
+
+    def set_description(self, index):
+        description_buffer = self.description_buffer
+        description_buffer.read_only = to_filter(False)
+        description_buffer.text = f'   {self.description(index)}'
+        description_buffer.read_only = to_filter(True)
+
+    @property
+    def selected_code(self):
+        return self.code(self._index)
+
+    @property
+    def selected_file_name(self):
+        return self.row(self._index)['file_name']
+
+    @property
+    def selected_description(self):
+        return self.descriptions[self._index]
+
+    def print(self):
+        if not self.print_on_exit:
+            return
+        print('\n', file=sys.stderr)
+        print(file=sys.stderr)
+        print(self.selected_code, file=sys.stderr)
+        print('', file=sys.stderr)
+
+    def register_windows(self, *windows):
+        self.windows = windows
+        self.current_window_index = 0
+
+    def focus_window(self, index):
+        self.current_window_index = index
+        return self.current_window
+
+    def next_window(self):
+        self.current_window_index = (self.current_window_index + 1) % len(self.windows)
+        return self.current_window
+
+    @property
+    def current_window(self):
+        return self.windows[self.current_window_index]
+
+
+class UI:
+    def __init__(self):
+        # A running gf serve already has everything loaded.  It needs unix sockets.
+        loader = None
+        if hasattr(socket, 'AF_UNIX'):
+            from .server import RemoteLoader
+            loader = RemoteLoader.connect(Loader.socket_file)
+        loader = loader or Loader()
+        if not loader.has_tables:
+            msg = 'You must run sync command'
+            print(msg, file=sys.stderr)
+            sys.exit(1)
+
+        self.state = AppState(loader)
+
+    def get_container(self):
+
+        list_window = Window(
+            width=55,
+            left_margins=[NumberedMargin()],
+            content=self.state.list_control,
+            cursorline=True,
+            style='bg:#AE9EC9 fg:black',
+        )
+
+        code_window = Window(
+            left_margins=[NumberedMargin()],
+            content=BufferControl(buffer=self.state.content_buffer, focusable=True, lexer=self.state.code_lexer),
+            ignore_content_width=True
+        )
+        description_window = Window(
+            content=BufferControl(
+                buffer=self.state.description_buffer,
+                focusable=False,
+                # key_bindings=self.get_search_key_bindings(),
+            ),
+            height=1,
+            style='bg:#1B2631  fg:#F1C40F',
+        )
+
+        search_window = Window(
+            content=BufferControl(
+                buffer=self.state.search_buffer,
+                focusable=True,
+                key_bindings=self.get_search_key_bindings(),
+            ),
+            height=1,
+            style='bg:#1B2631  fg:#F1C40F',
+        )
+
+        slash_window = Window(
+            content=BufferControl(
+                buffer=self.state.slash_buffer,
+                focusable=False,
+            ),
+            height=1,
+            width=1,
+            style='bg:#1B2631  fg:#F1C40F',
+        )
+
+        self.state.register_windows(list_window, code_window)
+        self.state.search_window = search_window
+
+        main_container = VSplit([list_window, code_window])
+        search_container = VSplit([slash_window, search_window])
+
+        root_container = HSplit([
+            description_window,
+            main_container,
+            search_container,
+        ])
+        return root_container
+
+    def get_search_key_bindings(self):
+        kb = KeyBindings()
+
+        @kb.add('enter', eager=True)
+        def _(event):
+            window_to_focus = event.app.state.focus_window(0)
+            event.app.layout.focus(window_to_focus)
+
+        return kb
+
+    def get_key_bindings(self):
+        kb = KeyBindings()
+
+        @kb.add('c-c')
+        def _(event):
+            " Quit application. "
+            event.app.exit()
+
+        @kb.add('c-q')
+        def _(event):
+            " Quit application. "
+            event.app.exit()
+
+        @kb.add('enter')
+        def _(event):
+            " Quit application. "
+            event.app.state.print_on_exit = True
+            event.app.exit()
+
+        @kb.add('space', filter=not_in_search_mode)
+        def _(event):
+            " Quit application. "
+            window_to_focus = event.app.state.next_window()
+            event.app.layout.focus(window_to_focus)
+
+        @kb.add('/')
+        def _(event):
+            " Go into search mode "
+            window_to_focus = event.app.state.search_window
+            event.app.layout.focus(window_to_focus)
+            event.app.state.search_buffer.read_only = to_filter(False)
+            event.app.state.search_buffer.text = ''
+
+            event.app.state.slash_buffer.read_only = to_filter(False)
+            event.app.state.slash_buffer.text = '/'
+            event.app.state.slash_buffer.read_only = to_filter(True)
+
+        @kb.add('escape')
+        def _(event):
+            " Get out of search mode "
+            window_to_focus = event.app.state.focus_window(0)
+            event.app.layout.focus(window_to_focus)
+            event.app.state.search_buffer.text = AppState.SEARCH_DEFAULT_TEXT
+            event.app.state.search_buffer.read_only = to_filter(True)
+
+            event.app.state.slash_buffer.read_only = to_filter(False)
+            event.app.state.slash_buffer.text = ''
+            event.app.state.slash_buffer.read_only = to_filter(True)
+
+            event.app.state.clear_searches()
+            event.app.state.schedule_search()
+
+        return kb
+
+    def run(self):
+        root_container = self.get_container()
+        kb = self.get_key_bindings()
+
+        layout = Layout(root_container)
+        style = Style(
+            [
+                ('cursor-line', 'fg:ansiwhite bg:#003366'),
+                ('cursor-line', 'fg:#CCCCCC bg:#003366'),
+            ]
+        )
+
+        app = Application(
+            layout=layout,
+            full_screen=True,
+            key_bindings=kb,
+            editing_mode=EditingMode.VI,
+            mouse_support=True,
+            style=style,
+        )
+        self.state.app = app
+        self.state.layout = layout
+        app.state = self.state
+
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel(logging.CRITICAL)
+
+        app.run()
+        self.state.print()
+        self.state.loader.save_query_cache()
@@ -1,3 +1,10 @@
+import itertools
+import re
+
+NON_WORD_REX = re.compile(r'\W+')
+WHITESPACE_REX = re.compile(r'\s+')
+
+
 class cached_property(object):
     """
     This is a direct copy-paste of Django's cached property from
@@ -16,3 +23,64 @@ class cached_property(object):
 def print_temp(*args, file_name='/tmp/gistfinder.log'):
     with open(file_name, 'a') as buff:
         print(*args, file=buff)
+
+
+def trigrams(text):
+    """
+    Returns the set of character trigrams in text after the same lowercasing and
+    punctuation stripping fuzzywuzzy applies before scoring.
+    """
+    text = NON_WORD_REX.sub(' ', text.lower()).strip()
+    return {text[ind:ind + 3] for ind in range(len(text) - 2)}
+
+
+def normalize_text(text):
+    """
+    Returns text lowercased with every run of whitespace collapsed to one space.
+    """
+    return WHITESPACE_REX.sub(' ', text.lower()).strip()
+
+
+def search_text(file_name, description, code):
+    """
+    The normalized text the 'text' field is scored on.
+    """
+    return normalize_text('\n'.join([file_name, description or '', code]))
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of up to size items from iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def in_params(values, prefix='v'):
+    """
+    Returns a placeholder string and bind params for an sql "in (...)" clause.
+    """
+    params = {f'{prefix}{ind}': value for ind, value in enumerate(values)}
+    placeholders = ', '.join(f':{name}' for name in params)
+    return placeholders, params
+
+
+def line_windows(text, size, overlap=0):
+    """
+    Splits text into windows of up to size lines, each sharing overlap lines with
+    the one before.  Returns (first_line, last_line, text) tuples with 1-based line
+    numbers.  Text of size lines or fewer is a single window.
+    """
+    lines = text.splitlines()
+    if len(lines) <= size:
+        return [(1, max(len(lines), 1), text)]
+
+    windows = []
+    for start in range(0, len(lines) - overlap, size - overlap):
+        window = lines[start:start + size]
+        windows.append((start + 1, start + len(window), '\n'.join(window)))
+    return windows
@@ -44,6 +44,7 @@ docs_require = [
 
 extras_require = {
     'dev': tests_require + docs_require,
+    'rapidfuzz': ['rapidfuzz'],
 }
 
 setup(